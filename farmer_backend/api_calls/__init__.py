@@ -1 +1,3 @@
-from .main import start_scheduler
\ No newline at end of file
+from .scheduler import forecast_scheduler
+from .forecast_cache import forecast_cache
+from .writer import api_data_writer
\ No newline at end of file
@@ -0,0 +1,135 @@
+import numpy as np
+
+# Keys the forecast API may use for an entry's timestamp.
+TIME_KEYS = ("date", "dateTime", "timestamp")
+
+
+def _parse_values(raw_values):
+    """Convert value strings to float64; anything unparsable becomes NaN."""
+    try:
+        return np.asarray(raw_values, dtype=np.float64)
+    except (TypeError, ValueError):
+        values = np.empty(len(raw_values), dtype=np.float64)
+        for i, raw in enumerate(raw_values):
+            try:
+                values[i] = float(raw)
+            except (TypeError, ValueError):
+                values[i] = np.nan
+        return values
+
+
+def _entry_day(entry):
+    for key in TIME_KEYS:
+        if entry.get(key):
+            # ISO timestamps start with the calendar day, e.g. "2025-03-20T06:00:00".
+            return str(entry[key])[:10]
+    return ""
+
+
+class DailyAggregates:
+    """
+    Per-label, per-day statistics of one forecast payload.
+
+    Each statistic is a (n_labels, n_days) array; cells with no valid
+    observation hold NaN.
+    """
+
+    def __init__(self, labels, days, sums, means, mins, maxs, counts):
+        self.labels = labels
+        self.days = days
+        self.sum = sums
+        self.mean = means
+        self.min = mins
+        self.max = maxs
+        self.count = counts
+
+    def horizon_means(self):
+        """
+        One value per label: the mean over days of each day's mean.
+
+        This is what the insight functions read. For daily labels it equals the
+        average of the daily values; hourly labels are weighted per day, not per row.
+        """
+        with np.errstate(invalid="ignore"):
+            valid = self.count > 0
+            day_counts = valid.sum(axis=1)
+            totals = np.where(valid, self.mean, 0.0).sum(axis=1)
+            means = np.where(day_counts > 0, totals / np.maximum(day_counts, 1), np.nan)
+        return {label: float(value) for label, value in zip(self.labels, means.tolist()) if not np.isnan(value)}
+
+    def to_dict(self):
+        """JSON-ready daily breakdown; NaN cells become None because JSONB rejects NaN."""
+        def clean(row):
+            return [None if np.isnan(v) else v for v in row]
+
+        return {
+            "days": list(self.days),
+            "labels": {
+                label: {
+                    "sum": clean(self.sum[i].tolist()),
+                    "mean": clean(self.mean[i].tolist()),
+                    "min": clean(self.min[i].tolist()),
+                    "max": clean(self.max[i].tolist()),
+                }
+                for i, label in enumerate(self.labels)
+            },
+        }
+
+
+def aggregate_forecast(hourly_data):
+    """
+    Group a forecast payload by measure label and calendar day in one array pass.
+
+    Expects each item in hourly_data to have keys:
+      - 'measureLabel'
+      - 'value'
+      - a timestamp under one of TIME_KEYS
+    Values that are missing or not numeric are ignored rather than counted as 0.
+    """
+    hourly_data = hourly_data or []
+    labels = np.array([(entry.get("measureLabel") or "").strip() for entry in hourly_data], dtype=object)
+    days = np.array([_entry_day(entry) for entry in hourly_data], dtype=object)
+    values = _parse_values([entry.get("value") for entry in hourly_data])
+
+    valid = ~np.isnan(values) & (labels != "")
+    labels, days, values = labels[valid], days[valid], values[valid]
+    if not len(values):
+        empty = np.empty((0, 0))
+        return DailyAggregates([], [], empty, empty, empty, empty, empty.astype(np.int64))
+
+    label_names, label_index = np.unique(labels, return_inverse=True)
+    day_names, day_index = np.unique(days, return_inverse=True)
+    n_labels, n_days = len(label_names), len(day_names)
+
+    groups = label_index * n_days + day_index
+    size = n_labels * n_days
+
+    counts = np.bincount(groups, minlength=size)
+    sums = np.bincount(groups, weights=values, minlength=size)
+    mins = np.full(size, np.inf)
+    maxs = np.full(size, -np.inf)
+    np.minimum.at(mins, groups, values)
+    np.maximum.at(maxs, groups, values)
+
+    empty_cells = counts == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    sums[empty_cells] = np.nan
+    means[empty_cells] = np.nan
+    mins[empty_cells] = np.nan
+    maxs[empty_cells] = np.nan
+
+    shape = (n_labels, n_days)
+    return DailyAggregates(
+        label_names.tolist(), day_names.tolist(),
+        sums.reshape(shape), means.reshape(shape), mins.reshape(shape), maxs.reshape(shape),
+        counts.reshape(shape),
+    )
+
+
+def aggregate_hourly_to_daily(hourly_data):
+    """
+    Collapse a forecast payload into a single dictionary of one value per measure label,
+    the input shape of the compute_* insight functions.
+    """
+    return aggregate_forecast(hourly_data).horizon_means()
@@ -0,0 +1,167 @@
+"""
+Recompute insights for the whole fleet after a formula change.
+
+    python -m api_calls.backfill                     # replay archived forecasts
+    python -m api_calls.backfill --source fetch --base-url http://localhost:8080
+
+Farms are grouped by forecast tile and tiles are processed in chunks: each chunk's
+forecasts are loaded, its insights are computed in a process pool, and only farms
+whose fingerprints changed are written back in one bulk statement. Finished tiles
+are appended to a checkpoint file, so an interrupted run picks up where it stopped;
+tiles whose forecast could not be loaded are left out of it and retried next run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from models import my_farmer_db, my_async_farmer_db
+from tools import logger
+from api_calls.main import build_forecast_data_batch, changed_fields, fetch_forecast
+from api_calls.registry import FINGERPRINT_KEY
+from api_calls.http_client import ForecastHttpClient, BASE_URL
+from api_calls.history import tile_baselines, tile_key
+from api_calls.tiles import snap_to_tile
+
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", 200))
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", os.cpu_count() or 1))
+BACKFILL_CHECKPOINT = os.getenv("BACKFILL_CHECKPOINT", "backfill.checkpoint")
+
+
+def group_farms_by_tile():
+    """{tile key: (tile, [farm ids])} for every registered farm with valid coordinates."""
+    tiles = {}
+    for user in my_farmer_db.iter_users(columns=("id", "longitude", "latitude")):
+        try:
+            tile = snap_to_tile(user["longitude"], user["latitude"])
+        except (TypeError, ValueError):
+            logger.warning("Skipping farm %s with invalid coordinates", user["id"])
+            continue
+        tiles.setdefault(tile_key(tile), (tile, []))[1].append(str(user["id"]))
+    return tiles
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {json.loads(line) for line in f if line.strip()}
+
+
+def compute_chunk(items):
+    """
+    Worker-process entry point: [(tile key, (results, baselines))] -> [(tile key, aggregated data)].
+
+    Top-level so it can be pickled by the process pool; it never touches the database.
+    """
+    keys = [key for key, _ in items]
+    return list(zip(keys, build_forecast_data_batch([results for _, (results, _) in items],
+                                                    [baselines for _, (_, baselines) in items])))
+
+
+async def load_chunk(keys, tiles, source, client):
+    """
+    {tile key: (raw endpoint results, insight baselines)} for a chunk of tiles, the
+    results from the archive or a fresh fetch and the baselines from the tile's history.
+    """
+    if source == "archive":
+        payloads = await my_async_farmer_db.get_latest_forecast_archive(keys)
+    else:
+        fetched = await asyncio.gather(*(fetch_forecast(*tiles[key][0], client=client) for key in keys))
+        payloads = {key: results for key, results in zip(keys, fetched) if any(results.values())}
+    baselines = await asyncio.gather(*(asyncio.to_thread(tile_baselines, tiles[key][0]) for key in payloads))
+    return {key: (results, baseline) for (key, results), baseline in zip(payloads.items(), baselines)}
+
+
+def write_chunk(computed, tiles):
+    """Bulk-merge the changed part of every farm's api_data; returns the number of farms written."""
+    farm_ids = [id for key, _ in computed for id in tiles[key][1]]
+    stored = my_farmer_db.get_api_data_fingerprints(farm_ids)
+    records = []
+    for key, aggregated_data in computed:
+        for id in tiles[key][1]:
+            stored_fingerprints = stored.get(id) or {}
+            # Keep fingerprints of groups the backfill does not recompute (e.g. benchmarks).
+            farm_data = dict(aggregated_data)
+            farm_data[FINGERPRINT_KEY] = {**stored_fingerprints, **aggregated_data[FINGERPRINT_KEY]}
+            patch = changed_fields(farm_data, stored_fingerprints)
+            if patch is not None:
+                records.append((id, patch))
+    return my_farmer_db.merge_api_data_many(records)
+
+
+async def run_backfill(source="archive", base_url=BASE_URL, chunk_size=BACKFILL_CHUNK_SIZE,
+                       workers=BACKFILL_WORKERS, checkpoint=BACKFILL_CHECKPOINT, restart=False):
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    tiles = await asyncio.to_thread(group_farms_by_tile)
+    done = load_checkpoint(checkpoint)
+    pending = [key for key in sorted(tiles) if key not in done]
+    logger.info("Backfill: %d tiles, %d already done, %d to go", len(tiles), len(tiles) - len(pending), len(pending))
+
+    client = ForecastHttpClient(base_url=base_url) if source == "fetch" else None
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    stats = {"tiles": 0, "missing": 0, "farms": 0, "written": 0}
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool, open(checkpoint, "a") as checkpoint_file:
+            chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+            # Load the next chunk while the pool works on the current one.
+            next_load = asyncio.ensure_future(load_chunk(chunks[0], tiles, source, client)) if chunks else None
+            for n, keys in enumerate(chunks, 1):
+                payloads = await next_load
+                if n < len(chunks):
+                    next_load = asyncio.ensure_future(load_chunk(chunks[n], tiles, source, client))
+
+                items = list(payloads.items())
+                per_worker = max(1, -(-len(items) // workers))
+                parts = [items[i:i + per_worker] for i in range(0, len(items), per_worker)]
+                computed = [pair for part in await asyncio.gather(
+                    *(loop.run_in_executor(pool, compute_chunk, part) for part in parts)) for pair in part]
+                stats["written"] += await asyncio.to_thread(write_chunk, computed, tiles)
+
+                stats["tiles"] += len(keys)
+                stats["missing"] += len(keys) - len(payloads)
+                stats["farms"] += sum(len(tiles[key][1]) for key in payloads)
+                for key in payloads:
+                    checkpoint_file.write(json.dumps(key) + "\n")
+                checkpoint_file.flush()
+
+                elapsed = time.monotonic() - started
+                eta = elapsed / stats["tiles"] * (len(pending) - stats["tiles"])
+                logger.info("Backfill chunk %d/%d: %d/%d tiles, %d farms written, %.1f tiles/s, ETA %.0fs",
+                            n, len(chunks), stats["tiles"], len(pending), stats["written"],
+                            stats["tiles"] / elapsed, eta)
+    finally:
+        if client is not None:
+            await client.aclose()
+
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 2)
+    stats["tiles_per_second"] = round(stats["tiles"] / elapsed, 1) if elapsed else 0.0
+    stats["farms_per_second"] = round(stats["farms"] / elapsed, 1) if elapsed else 0.0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute insights for every farm.")
+    parser.add_argument("--source", choices=["archive", "fetch"], default="archive",
+                        help="replay archived forecasts or re-fetch them (default: archive)")
+    parser.add_argument("--base-url", default=BASE_URL,
+                        help="forecast service to re-fetch from, e.g. a local stand-in (default: BASE_URL)")
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE, help="tiles per work unit")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="compute processes")
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT, help="file recording finished tiles")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    args = parser.parse_args(argv)
+
+    stats = asyncio.run(run_backfill(args.source, args.base_url, args.chunk_size, args.workers,
+                                     args.checkpoint, args.restart))
+    print(f"Backfilled {stats['tiles']} tiles ({stats['missing']} without forecasts), "
+          f"{stats['written']} of {stats['farms']} farms written in {stats['seconds']}s: "
+          f"{stats['tiles_per_second']} tiles/s, {stats['farms_per_second']} farms/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+from collections.abc import Sequence
+import numpy as np
+import api_calls.process  # registers the compute_* insights
+from api_calls.registry import INSIGHTS, required_labels
+
+# Every daily measure label read by the insight formulas below.
+INSIGHT_LABELS = required_labels(INSIGHTS.values())
+
+
+def build_farm_table(daily_rows, labels=INSIGHT_LABELS):
+    """
+    Build a column-oriented table of shape (n_farms, n_labels) from a list of
+    per-farm daily dictionaries (DailyAggregates.horizon_means() output).
+
+    Missing labels default to 0, the same as the scalar compute_* functions.
+    Each column is contiguous in memory so the insight kernels read it without copying.
+    """
+    n = len(daily_rows)
+    table = np.empty((n, len(labels)), dtype=np.float64, order="F")
+    for j, label in enumerate(labels):
+        try:
+            table[:, j] = np.fromiter((row.get(label, 0) for row in daily_rows), dtype=np.float64, count=n)
+        except Exception as e:
+            raise ValueError(f"Missing data for {label}") from e
+    return table, list(labels)
+
+
+def compute_insight_columns(table, labels=INSIGHT_LABELS, insights=INSIGHTS, baselines=None):
+    """
+    Compute every insight for all farms in one vectorized pass, with the fixed
+    parameters each insight is registered with. baselines maps history series to
+    one baseline per farm, NaN where the farm has none.
+
+    Returns {insight name: {output key: array}}. Scores are left unrounded so that
+    InsightRecords can round them exactly like the scalar functions do.
+    """
+    index = {label: j for j, label in enumerate(labels)}
+
+    def col(label):
+        if label in index:
+            return table[:, index[label]]
+        return np.zeros(table.shape[0])
+
+    def baseline(series, default):
+        values = (baselines or {}).get(series)
+        if values is None:
+            return np.full(table.shape[0], float(default))
+        return np.where(np.isnan(values), default, values)
+
+    temp_avg = col("TempAir_DailyAvg")
+    temp_max = col("TempAir_DailyMax")
+    temp_min = col("TempAir_DailyMin")
+    global_rad = col("GlobalRadiation_DailySum")
+    soilmoisture_avg = col("Soilmoisture_0to10cm_DailyAvg")
+    soiltemp_avg = col("Soiltemperature_0to10cm_DailyAvg")
+    evap = col("Evapotranspiration_DailySum")
+    ref_evap = col("Referenceevapotranspiration_DailySum")
+    precip = col("Precip_DailySum")
+    humidity_avg = col("HumidityRel_DailyAvg")
+    wind_speed_avg = col("WindSpeed_DailyAvg")
+    cloudcover_avg = col("Cloudcover_DailyAvg")
+
+    # The expressions mirror api_calls/process.py operation for operation,
+    # so float64 results are bit-identical to the scalar path.
+    growth = (temp_avg / 40 * 0.3 + global_rad / 1000 * 0.4 + soilmoisture_avg / 100 * 0.3) * 100
+    water = precip / (evap + 0.1) * (soilmoisture_avg / 100)
+    rainfall = precip + (soilmoisture_avg / 10) - evap
+    heat = (temp_max - temp_min) * (100 - humidity_avg) / 100 + wind_speed_avg
+    seasonal = precip / (evap + 0.1) - insights["Seasonal Water Use Comparison"].params["irrigation_method_data"]
+    yield_score = (temp_avg / 40 * 0.4 + global_rad / 1000 * 0.3 + soilmoisture_avg / 100 * 0.3) * 100
+    timing = (temp_avg / 40) * 3 + (1 - precip / 10) * 3 + (1 - humidity_avg / 100) * 2 + (1 - wind_speed_avg / 10) * 2
+    resource = precip / (evap + 0.1) - insights["Resource Efficiency"].params["irrigation_method_data"]
+    stress_factor = (temp_avg + precip + (100 - humidity_avg) + (100 - soilmoisture_avg)) / 4
+    pest = (humidity_avg / 100) * (1 - wind_speed_avg / 10) + (precip / 10)
+    frost = (temp_min < 0).astype(np.float64) + (cloudcover_avg / 100) + (1 - wind_speed_avg / 10)
+    irrigation = (100 - soilmoisture_avg) + ref_evap * 10 - precip
+    soil = (soilmoisture_avg / 100) * 50 + (100 - np.abs(soiltemp_avg - 20)) + (100 - evap * 10)
+
+    n = table.shape[0]
+    # These two do not read the forecast, so one scalar call serves every farm.
+    market = insights["Market Price Forecast"].compute({})["Market Price Forecast"]
+    labor = insights["Labor & Machinery Cost Insights"].compute({})["Labor & Machinery Cost Insights"]
+
+    return {
+        "Growth Efficiency": {
+            "Growth Efficiency Score": growth,
+            "Interpretation": np.where(growth > baseline("Growth Efficiency Score", 50), "Above benchmark", "Below benchmark"),
+        },
+        "Water Efficiency": {
+            "Water Efficiency Score": water,
+            "Interpretation": np.where(water > 1, "High efficiency", "Low efficiency"),
+        },
+        "Rainfall Utilization": {
+            "Rainfall Utilization Score": rainfall,
+            "Interpretation": np.where(rainfall > 0, "Good rainfall utilization", "Poor rainfall utilization"),
+        },
+        "Heat Stress Outlook": {
+            "Heat Stress Outlook Score": heat,
+            "Interpretation": np.where(heat > 10, "High heat stress", "Moderate heat stress"),
+        },
+        "Seasonal Water Use Comparison": {
+            "Seasonal Water Use Comparison Score": seasonal,
+            "Interpretation": np.where(seasonal > 1, "Efficient", "Inefficient"),
+        },
+        "Yield Prediction": {
+            "Yield Prediction Score": yield_score,
+            "Interpretation": np.where(yield_score > 50, "High yield potential", "Low yield potential"),
+        },
+        "Market Price Forecast": {
+            "Market Price Forecast": np.full(n, market),
+        },
+        "Harvest Timing Recommendation": {
+            "Harvest Timing Recommendation Score": timing,
+            "Interpretation": np.where(timing > 5, "Optimal harvest window", "Delayed harvest recommended"),
+        },
+        "Labor & Machinery Cost Insights": {
+            "Labor & Machinery Cost Insights": np.full(n, labor),
+        },
+        "Resource Efficiency": {
+            "Resource Efficiency Score": resource,
+            "Interpretation": np.where(resource > 1, "Efficient resource use", "Inefficient resource use"),
+        },
+        "Recommended Biological Products": {
+            "Recommended Biological Products": np.where(stress_factor > 50, "Biological product recommended", "No product needed"),
+        },
+        "Pest & Disease Alert": {
+            "Pest & Disease Alert Score": pest,
+            "Interpretation": np.where(pest > 1, "High pest & disease risk", "Low pest & disease risk"),
+        },
+        "Frost Risk": {
+            "Frost Risk Score": frost,
+            "Interpretation": np.where(frost > 1.5, "High frost risk", "Low frost risk"),
+        },
+        "Irrigation Risk": {
+            "Irrigation Risk Score": irrigation,
+            "Interpretation": np.where(irrigation > 50, "High irrigation risk", "Low irrigation risk"),
+        },
+        "Soil Protection Recommendations": {
+            "Soil Protection Recommendations": np.where(soil < 70, "Soil protection measures recommended", "Soil conditions acceptable"),
+        },
+    }
+
+
+# Decimal places each score is rounded to by its scalar counterpart.
+SCORE_DIGITS = {
+    "Growth Efficiency Score": 1,
+    "Water Efficiency Score": 2,
+    "Rainfall Utilization Score": 1,
+    "Heat Stress Outlook Score": 1,
+    "Seasonal Water Use Comparison Score": 2,
+    "Yield Prediction Score": 1,
+    "Harvest Timing Recommendation Score": 2,
+    "Resource Efficiency Score": 2,
+    "Pest & Disease Alert Score": 2,
+    "Frost Risk Score": 2,
+    "Irrigation Risk Score": 2,
+}
+
+
+def round_column(values, digits):
+    """
+    Round an array exactly like Python's round() does for each element.
+
+    np.round scales by 10**digits before rounding, which can flip values that sit
+    within one ulp of a .5 boundary; those few are re-rounded with the builtin.
+    """
+    scale = 10.0 ** digits
+    scaled = values * scale
+    rounded = np.rint(scaled) / scale
+    near_tie = np.abs(np.abs(scaled - np.floor(scaled)) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_tie | ~np.isfinite(scaled)).tolist():
+        rounded[i] = round(float(values[i]), digits)
+    return rounded
+
+
+class InsightRecords(Sequence):
+    """
+    Per-farm view of the insights computed for a batch: element i is shaped exactly
+    like add_extra_data's result for farm i.
+
+    Scores are rounded and every column is converted to Python values once, up
+    front; a farm's dictionary is only built when it is accessed, so a caller that
+    reads a few farms, or the columns directly, does not pay for all of them.
+    """
+
+    def __init__(self, names, columns, scalar_results=None, n=0):
+        self.names = list(names)
+        self.columns = {}
+        for name in self.names:
+            if name in columns:
+                self.columns[name] = {key: round_column(column, SCORE_DIGITS[key]) if key in SCORE_DIGITS else column
+                                      for key, column in columns[name].items()}
+        values = {name: [(key, column.tolist()) for key, column in outputs.items()]
+                  for name, outputs in self.columns.items()}
+        # Insights without a vectorized kernel carry one result dict per farm instead.
+        scalar_results = scalar_results or {}
+        self._layout = [(name, values.get(name), scalar_results.get(name)) for name in self.names]
+        self._n = n
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError("farm index out of range")
+        return {name: {key: column[i] for key, column in values} if values is not None else results[i]
+                for name, values, results in self._layout}
+
+
+def compute_insights_batch(daily_rows, names=None, insights=INSIGHTS, baselines=None):
+    """
+    Vectorized equivalent of calling add_extra_data on every element of daily_rows.
+
+    names optionally restricts (and orders) the insights that are returned, and
+    baselines optionally holds each row's baselines dict (see compute_insights).
+    Registered insights without a vectorized kernel here fall back to their scalar
+    function. Returns an InsightRecords sequence.
+    """
+    baselines = baselines or [None] * len(daily_rows)
+    table, labels = build_farm_table(daily_rows)
+    series = {insight.baseline for insight in insights.values() if insight.baseline}
+    baseline_columns = {name: np.fromiter(((row or {}).get(name, np.nan) for row in baselines),
+                                          dtype=np.float64, count=len(baselines))
+                        for name in series}
+    columns = compute_insight_columns(table, labels, insights=insights, baselines=baseline_columns)
+    names = list(columns) if names is None else list(names)
+    scalar_results = {name: [insights[name].compute(row, row_baselines) for row, row_baselines in zip(daily_rows, baselines)]
+                      for name in names if name not in columns}
+    return InsightRecords(names, columns, scalar_results, n=len(daily_rows))
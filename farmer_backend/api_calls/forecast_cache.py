@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import json
+import os
+import redis
+from tools import logger, TTLCache
+
+# Serve repeated refreshes from cache inside the forecast validity window, but keep the
+# TTL below the scheduler interval so every scheduled cycle still sees a fresh forecast.
+FORECAST_CACHE_TTL = int(os.getenv("FORECAST_CACHE_TTL_SECONDS", 3000))
+FORECAST_CACHE_SIZE = int(os.getenv("FORECAST_CACHE_SIZE", 4096))
+FORECAST_CACHE_REDIS_URL = os.getenv("FORECAST_CACHE_REDIS_URL", os.getenv("CELERY_BROKER_URL"))
+
+# Parameters that never change the response and must not end up in cache keys.
+IGNORED_PARAMS = {"ApiKey"}
+
+
+class ForecastCache:
+    """
+    Two-tier cache for raw forecast responses.
+
+    Lookups go to an in-process TTLCache first, then to Redis, which survives
+    restarts and is shared by every worker. Redis errors are logged and treated
+    as misses so the refresh never fails because the cache is unavailable.
+    On the event loop use aget/aset, which run the blocking Redis calls in a thread.
+    """
+
+    def __init__(self, ttl=FORECAST_CACHE_TTL, maxsize=FORECAST_CACHE_SIZE, redis_url=FORECAST_CACHE_REDIS_URL):
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.redis_url = redis_url
+        self._redis = None
+        self.redis_hits = 0
+        self.redis_errors = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(path, params):
+        key_params = {k: v for k, v in params.items() if k not in IGNORED_PARAMS}
+        for coordinate in ("longitude", "latitude"):
+            if coordinate in key_params:
+                key_params[coordinate] = round(float(key_params[coordinate]), 4)
+        raw = json.dumps([path, key_params], sort_keys=True, default=str)
+        return "forecast:" + hashlib.sha1(raw.encode()).hexdigest()
+
+    def _get_redis(self):
+        if self._redis is None and self.redis_url and self.redis_url.startswith(("redis://", "rediss://", "unix://")):
+            self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+        return self._redis
+
+    def get(self, path, params):
+        key = self.make_key(path, params)
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                raw = client.get(key)
+            except redis.RedisError as e:
+                self.redis_errors += 1
+                logger.warning("Forecast cache Redis lookup failed: %s", e)
+                raw = None
+            if raw is not None:
+                self.redis_hits += 1
+                value = json.loads(raw)
+                # Keep the remaining Redis lifetime so both tiers expire together.
+                try:
+                    remaining = client.ttl(key)
+                except redis.RedisError:
+                    remaining = self.ttl
+                self.local.set(key, value, ttl=remaining if remaining and remaining > 0 else self.ttl)
+                return value
+
+        self.misses += 1
+        return None
+
+    def set(self, path, params, value):
+        key = self.make_key(path, params)
+        self.local.set(key, value)
+        client = self._get_redis()
+        if client is not None:
+            try:
+                client.set(key, json.dumps(value), ex=self.ttl)
+            except redis.RedisError as e:
+                self.redis_errors += 1
+                logger.warning("Forecast cache Redis store failed: %s", e)
+
+    async def aget(self, path, params):
+        if self._get_redis() is None:
+            return self.get(path, params)
+        return await asyncio.to_thread(self.get, path, params)
+
+    async def aset(self, path, params, value):
+        if self._get_redis() is None:
+            return self.set(path, params, value)
+        await asyncio.to_thread(self.set, path, params, value)
+
+    def stats(self):
+        local = self.local.stats()
+        lookups = local["hits"] + self.redis_hits + self.misses
+        return {
+            "ttl": self.ttl,
+            "local": local,
+            "redis_hits": self.redis_hits,
+            "redis_errors": self.redis_errors,
+            "misses": self.misses,
+            "hit_rate": round((local["hits"] + self.redis_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+forecast_cache = ForecastCache()
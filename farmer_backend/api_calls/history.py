@@ -0,0 +1,195 @@
+import datetime
+import warnings
+import numpy as np
+from models import my_farmer_db
+from api_calls.batch import build_farm_table, compute_insight_columns, SCORE_DIGITS
+from api_calls.registry import baseline_series, fingerprint
+
+# Rolling windows, in days, reported as historical benchmarks.
+BENCHMARK_WINDOWS = (7, 30, 90)
+# Trailing window, in days, of the baselines that insights compare against (see Insight.baseline).
+BASELINE_WINDOW = 30
+
+
+def tile_key(tile):
+    longitude, latitude = tile
+    return f"{longitude:.6f}:{latitude:.6f}"
+
+
+def daily_history_rows(daily):
+    """
+    Turn a DailyAggregates into history rows, one per forecast day.
+
+    Every day's label means also go through the vectorized insight engine, so the
+    history holds a per-day score for each numeric insight.
+    """
+    labels = list(daily.labels)
+    if not labels:
+        return labels, [], []
+
+    day_rows = [
+        {label: daily.mean[i, j] for i, label in enumerate(labels) if daily.count[i, j] > 0}
+        for j in range(len(daily.days))
+    ]
+    table, table_labels = build_farm_table(day_rows)
+    columns = compute_insight_columns(table, table_labels)
+    score_keys = [(name, key) for name, outputs in columns.items() for key in outputs if key in SCORE_DIGITS]
+    insights = [key for _, key in score_keys]
+    scores = np.column_stack([columns[name][key] for name, key in score_keys])
+
+    def clean(values):
+        return [None if np.isnan(v) else float(v) for v in values]
+
+    rows = []
+    for j, day in enumerate(daily.days):
+        try:
+            day = datetime.date.fromisoformat(day)
+        except ValueError:
+            continue
+        rows.append((day, clean(daily.mean[:, j]), clean(daily.min[:, j]), clean(daily.max[:, j]),
+                     clean(daily.sum[:, j]), clean(scores[j])))
+    return labels, insights, rows
+
+
+def append_history(tile, daily):
+    """Append one forecast issue for a tile to the daily history store."""
+    labels, insights, rows = daily_history_rows(daily)
+    if not rows:
+        return
+    layout = fingerprint([labels, insights])
+    my_farmer_db.append_daily_history(tile_key(tile), layout, labels, insights, rows)
+
+
+class HistoryFrame:
+    """
+    Dense day-by-series matrix for one tile.
+
+    values has shape (n_days, n_series); days with no stored data are NaN rows, so
+    a window of k rows always covers exactly k calendar days.
+    """
+
+    def __init__(self, start_day, names, values):
+        self.start_day = start_day
+        self.names = names
+        self.values = values
+
+    @property
+    def days(self):
+        return [self.start_day + datetime.timedelta(days=i) for i in range(self.values.shape[0])]
+
+    def rolling_mean(self, window):
+        """Trailing mean over `window` days ending on each day, ignoring missing days."""
+        valid = ~np.isnan(self.values)
+        sums = np.cumsum(np.where(valid, self.values, 0.0), axis=0)
+        counts = np.cumsum(valid, axis=0)
+        pad = np.zeros((1, self.values.shape[1]))
+        sums = np.vstack([pad, sums])
+        counts = np.vstack([pad, counts])
+        upper = np.arange(1, self.values.shape[0] + 1)
+        lower = np.maximum(upper - window, 0)
+        window_sums = sums[upper] - sums[lower]
+        window_counts = counts[upper] - counts[lower]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(window_counts > 0, window_sums / window_counts, np.nan)
+
+    def window_stats(self, window, latest):
+        """
+        Mean, standard deviation, z-score anomaly and percentile rank of `latest`
+        (one value per series) against the last `window` days.
+        """
+        recent = self.values[-window:]
+        with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+            # nanmean/nanstd warn on all-NaN columns; those are reported with days == 0.
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean = np.nanmean(recent, axis=0)
+            std = np.nanstd(recent, axis=0)
+            anomaly = np.where(std > 0, (latest - mean) / std, 0.0)
+            counts = np.sum(~np.isnan(recent), axis=0)
+            below = np.sum(recent < latest, axis=0) + 0.5 * np.sum(recent == latest, axis=0)
+            percentile = np.where(counts > 0, below / np.maximum(counts, 1) * 100, np.nan)
+        return {"mean": mean, "std": std, "anomaly": anomaly, "percentile": percentile, "days": counts}
+
+
+def load_history(tile, end_day, days=max(BENCHMARK_WINDOWS)):
+    """
+    Load the last `days` days (up to and including end_day) of a tile's history.
+
+    daily_history is partitioned by month only. Every read is one tile's range of
+    days, an index scan on the (tile, day, "issuedAt") key within one to four
+    partitions; sub-partitioning by tile would multiply the partition count by the
+    number of tiles without making these scans cheaper.
+    """
+    start_day = end_day - datetime.timedelta(days=days - 1)
+    rows = my_farmer_db.get_daily_history(tile_key(tile), start_day, end_day)
+
+    names = []
+    for row in rows:
+        for name in list(row["labels"]) + list(row["insights"]):
+            if name not in names:
+                names.append(name)
+    index = {name: k for k, name in enumerate(names)}
+
+    values = np.full((days, len(names)), np.nan)
+    for row in rows:
+        i = (row["day"] - start_day).days
+        columns = [index[name] for name in list(row["labels"]) + list(row["insights"])]
+        row_values = list(row["means"]) + list(row["scores"])
+        values[i, columns] = np.array(row_values, dtype=np.float64)
+    return HistoryFrame(start_day, names, values)
+
+
+def tile_history(tile, end_day=None):
+    """A tile's history up to the day before end_day (default: today), which the current forecast is compared to."""
+    end_day = end_day or datetime.date.today()
+    return load_history(tile, end_day - datetime.timedelta(days=1))
+
+
+def insight_baselines(frame, window=BASELINE_WINDOW, insights=None):
+    """
+    {series: mean over the frame's last `window` days} for the history series the
+    insights compare against, leaving out series without any data in the window.
+    """
+    names = [name for name in baseline_series(insights) if name in frame.names]
+    if not names:
+        return {}
+    means = frame.rolling_mean(window)[-1]
+    baselines = {}
+    for name in names:
+        value = means[frame.names.index(name)]
+        if not np.isnan(value):
+            baselines[name] = float(value)
+    return baselines
+
+
+def tile_baselines(tile, end_day=None):
+    return insight_baselines(tile_history(tile, end_day))
+
+
+def historical_benchmarks(frame, current_values):
+    """
+    Compare current label values and insight scores to a tile's rolling history
+    (see tile_history).
+
+    Returns {series: {"7d": {...}, "30d": {...}, "90d": {...}}} for every series in
+    current_values that has history, ready to be stored next to the insights.
+    """
+    names = [name for name in frame.names if name in current_values]
+    if not names:
+        return {}
+
+    columns = [frame.names.index(name) for name in names]
+    subset = HistoryFrame(frame.start_day, names, frame.values[:, columns])
+    latest = np.array([float(current_values[name]) for name in names])
+
+    benchmarks = {name: {} for name in names}
+    for window in BENCHMARK_WINDOWS:
+        stats = subset.window_stats(window, latest)
+        for k, name in enumerate(names):
+            if stats["days"][k] == 0:
+                continue
+            benchmarks[name][f"{window}d"] = {
+                "mean": round(float(stats["mean"][k]), 2),
+                "anomaly": round(float(stats["anomaly"][k]), 2),
+                "percentile": round(float(stats["percentile"][k]), 1),
+            }
+    return {name: windows for name, windows in benchmarks.items() if windows}
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import random
+import time
+import httpx
+from tools import logger, close_on_loop
+
+BASE_URL = os.getenv("BASE_URL", "https://services.cehub.syngenta-ais.com")
+HTTP_MAX_CONNECTIONS = int(os.getenv("FORECAST_HTTP_MAX_CONNECTIONS", 20))
+HTTP_PER_HOST_LIMIT = int(os.getenv("FORECAST_HTTP_PER_HOST_LIMIT", 10))
+HTTP_TIMEOUT = float(os.getenv("FORECAST_HTTP_TIMEOUT_SECONDS", 15))
+HTTP_RETRIES = int(os.getenv("FORECAST_HTTP_RETRIES", 3))
+HTTP_BACKOFF_BASE = float(os.getenv("FORECAST_HTTP_BACKOFF_SECONDS", 0.5))
+HTTP_BACKOFF_MAX = float(os.getenv("FORECAST_HTTP_BACKOFF_MAX_SECONDS", 10))
+# CEHub quota: sustained requests per second and the burst allowed on top of it.
+CEHUB_RATE_PER_SECOND = float(os.getenv("CEHUB_RATE_PER_SECOND", 5))
+CEHUB_RATE_BURST = int(os.getenv("CEHUB_RATE_BURST", 10))
+# Retries may add at most this fraction on top of first attempts, so an outage
+# cannot multiply upstream load.
+HTTP_RETRY_BUDGET_RATIO = float(os.getenv("FORECAST_HTTP_RETRY_BUDGET_RATIO", 0.2))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Async token bucket: acquire() waits until a token is available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class RetryBudget:
+    """Every first attempt deposits `ratio` tokens; every retry withdraws one."""
+
+    def __init__(self, ratio, minimum=3):
+        self.ratio = ratio
+        self.minimum = minimum
+        self._balance = float(minimum)
+
+    def record_request(self):
+        self._balance = min(self._balance + self.ratio, self.minimum + 100 * self.ratio)
+
+    def can_retry(self):
+        if self._balance >= 1:
+            self._balance -= 1
+            return True
+        return False
+
+
+class ForecastHttpClient:
+    """
+    Shared async HTTP client for the forecast endpoints.
+
+    One httpx.AsyncClient keeps a keep-alive connection pool. Requests are limited
+    per host, paced by a global token bucket, and bounded by timeouts. Failed calls
+    are retried with jittered exponential backoff while the retry budget allows it.
+    Point base_url (or the BASE_URL env var) at a local stub server to test it.
+    """
+
+    def __init__(self, base_url=BASE_URL, max_connections=HTTP_MAX_CONNECTIONS,
+                 per_host_limit=HTTP_PER_HOST_LIMIT, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES,
+                 backoff_base=HTTP_BACKOFF_BASE, backoff_max=HTTP_BACKOFF_MAX,
+                 rate=CEHUB_RATE_PER_SECOND, burst=CEHUB_RATE_BURST,
+                 retry_budget_ratio=HTTP_RETRY_BUDGET_RATIO, transport=None):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate = rate
+        self.burst = burst
+        self.retry_budget_ratio = retry_budget_ratio
+        self.transport = transport
+        self._client = None
+        self._loop = None
+        self._host_limits = {}
+        self._bucket = None
+        self._retry_budget = None
+
+    def _ensure_client(self):
+        # httpx and asyncio primitives belong to the loop that created them.
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            if self._client is not None:
+                close_on_loop(self._loop, self._client.aclose)
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                transport=self.transport,
+            )
+            self._loop = loop
+            self._host_limits = {}
+            self._bucket = TokenBucket(self.rate, self.burst)
+            self._retry_budget = RetryBudget(self.retry_budget_ratio)
+        return self._client
+
+    def _host_limit(self, url):
+        host = url.host
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_limits[host]
+
+    def _backoff(self, attempt, response=None):
+        if response is not None and "Retry-After" in response.headers:
+            try:
+                return min(float(response.headers["Retry-After"]), self.backoff_max)
+            except ValueError:
+                pass
+        # Full jitter keeps retrying clients from synchronising.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def get_json(self, path, params=None):
+        """GET base_url + path and return the decoded JSON body."""
+        client = self._ensure_client()
+        semaphore = self._host_limit(client.build_request("GET", path).url)
+        self._retry_budget.record_request()
+
+        attempt = 0
+        while True:
+            response = None
+            try:
+                await self._bucket.acquire()
+                async with semaphore:
+                    response = await client.get(path, params=params)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                error = httpx.HTTPStatusError(
+                    f"Retryable status {response.status_code}", request=response.request, response=response
+                )
+            except httpx.TransportError as e:
+                error = e
+
+            if attempt >= self.retries or not self._retry_budget.can_retry():
+                raise error
+            delay = self._backoff(attempt, response)
+            logger.warning("Retrying %s in %.2fs after: %s", path, delay, error)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+
+forecast_http_client = ForecastHttpClient()
@@ -1,35 +1,91 @@
 # data_updater.py
-import time
-import schedule
-from models import my_farmer_db
+from models import my_async_farmer_db
 from dotenv import load_dotenv
 import os
-import requests
+import asyncio
 import json
 from tools import logger
-from api_calls.process import (
-    compute_growth_efficiency,
-    compute_water_efficiency,
-    compute_rainfall_utilization,
-    compute_heat_stress_outlook,
-    compute_seasonal_water_use_comparison,
-    compute_yield_prediction,
-    compute_market_price_forecast,
-    compute_harvest_timing_recommendation,
-    compute_labor_machinery_cost_insights,
-    compute_resource_efficiency,
-    compute_recommended_biological_products,
-    compute_pest_disease_alert,
-    compute_frost_risk,
-    compute_irrigation_risk,
-    compute_soil_protection_recommendations,
-    aggregate_hourly_to_daily
-)
+import api_calls.process  # registers the compute_* insights
+from api_calls.registry import INSIGHTS, compute_insights, enabled_insights, required_labels, insight_fingerprints, fingerprint, FINGERPRINT_KEY
+from api_calls.aggregation import aggregate_forecast
+from api_calls.batch import compute_insights_batch
+from api_calls.tiles import snap_to_tile
+from api_calls.forecast_cache import forecast_cache
+from api_calls.http_client import forecast_http_client
+from api_calls.history import append_history, historical_benchmarks, insight_baselines, tile_history, tile_key
+from api_calls.writer import api_data_writer
 
 # Load environment variables
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
-BASE_URL = os.getenv("BASE_URL", "https://services.cehub.syngenta-ais.com")
+
+# Fingerprint entry for the top-level measure label values in api_data.
+INPUTS_FINGERPRINT = "__inputs__"
+
+# Every measure label the forecast endpoint offers. Requests only ask for the
+# labels read by the enabled insights (see build_measure_label).
+MEASURE_LABELS = [
+    "Temperature_15Min (C)",
+    "WindSpeed_15Min (m/s)",
+    "WindDirection_15Min",
+    "HumidityRel_15Min (pct)",
+    "Cloudcover_Hourly (pct)",
+    "GlobalRadiation_HourlySum (Wh/m2)",
+    "HumidityRel_Hourly (pct)",
+    "Precip_HourlySum (mm)",
+    "PrecipProbability_Hourly (pct)",
+    "ShowerProbability_Hourly (pct)",
+    "SnowFraction_Hourly",
+    "SunshineDuration_Hourly (min)",
+    "TempAir_Hourly (C)",
+    "Visibility_Hourly (m)",
+    "WindDirection_Hourly (Deg)",
+    "WindGust_Hourly (m/s)",
+    "WindSpeed_Hourly (m/s)",
+    "Soilmoisture_0to10cm_Hourly (vol%)",
+    "Soiltemperature_0to10cm_Hourly (C)",
+    "Referenceevapotranspiration_HourlySum (mm)",
+    "LeafWetnessProbability_Hourly (pct)",
+    "Cloudcover_DailyAvg (pct)",
+    "Evapotranspiration_DailySum (mm)",
+    "GlobalRadiation_DailySum (Wh/m2)",
+    "HumidityRel_DailyAvg (pct)",
+    "HumidityRel_DailyMax (pct)",
+    "HumidityRel_DailyMin (pct)",
+    "Precip_DailySum (mm)",
+    "PrecipProbability_Daily (pct)",
+    "ShowerProbability_DailyMax (pct)",
+    "SnowFraction_Daily (pct)",
+    "SunshineDuration_DailySum (min)",
+    "TempAir_DailyAvg (C)",
+    "TempAir_DailyMax (C)",
+    "TempAir_DailyMin (C)",
+    "ThunderstormProbability_DailyMax (pct)",
+    "WindDirection_DailyAvg (Deg)",
+    "WindGust_DailyMax (m/s)",
+    "WindSpeed_DailyAvg (m/s)",
+    "WindSpeed_DailyMax (m/s)",
+    "WindSpeed_DailyMin (m/s)",
+    "WindDirection_DailyAvg",
+    "Soilmoisture_0to10cm_DailyMax (vol%)",
+    "Soilmoisture_0to10cm_DailyAvg (vol%)",
+    "Soilmoisture_0to10cm_DailyMin (vol%)",
+    "Soiltemperature_0to10cm_DailyMax (C)",
+    "Soiltemperature_0to10cm_DailyAvg (C)",
+    "Soiltemperature_0to10cm_DailyMin (C)",
+    "Referenceevapotranspiration_DailySum (mm)",
+]
+
+
+def build_measure_label(labels):
+    """Build the measureLabel parameter for the catalog entries whose base name is in labels."""
+    wanted = set(labels)
+    selected = []
+    for full_label in MEASURE_LABELS:
+        if full_label.split(" (")[0] in wanted and full_label not in selected:
+            selected.append(full_label)
+    return ";\n".join(selected)
+
 
 endpoints = {
     "short_range_forecast": {
@@ -38,136 +94,194 @@ endpoints = {
             "supplier": "Meteoblue",
             "top": "50",
             "format": "json",
-            "measureLabel": (
-                "Temperature_15Min (C);\n"
-                "WindSpeed_15Min (m/s);\n"
-                "WindDirection_15Min;\n"
-                "HumidityRel_15Min (pct);\n"
-                "Cloudcover_Hourly (pct);\n"
-                "GlobalRadiation_HourlySum (Wh/m2);\n"
-                "HumidityRel_Hourly (pct);\n"
-                "Precip_HourlySum (mm);\n"
-                "PrecipProbability_Hourly (pct);\n"
-                "ShowerProbability_Hourly (pct);\n"
-                "SnowFraction_Hourly;\n"
-                "SunshineDuration_Hourly (min);\n"
-                "TempAir_Hourly (C);\n"
-                "Visibility_Hourly (m);\n"
-                "WindDirection_Hourly (Deg);\n"
-                "WindGust_Hourly (m/s);\n"
-                "WindSpeed_Hourly (m/s);\n"
-                "Soilmoisture_0to10cm_Hourly (vol%);\n"
-                "Soiltemperature_0to10cm_Hourly (C);\n"
-                "Referenceevapotranspiration_HourlySum (mm);\n"
-                "LeafWetnessProbability_Hourly (pct);\n"
-                "Cloudcover_DailyAvg (pct);\n"
-                "Evapotranspiration_DailySum (mm);\n"
-                "GlobalRadiation_DailySum (Wh/m2);\n"
-                "HumidityRel_DailyAvg (pct);\n"
-                "HumidityRel_DailyMax (pct);\n"
-                "HumidityRel_DailyMin (pct);\n"
-                "Precip_DailySum (mm);\n"
-                "PrecipProbability_Daily (pct);\n"
-                "ShowerProbability_DailyMax (pct);\n"
-                "SnowFraction_Daily (pct);\n"
-                "SunshineDuration_DailySum (min);\n"
-                "TempAir_DailyAvg (C);\n"
-                "TempAir_DailyMax (C);\n"
-                "TempAir_DailyMin (C);\n"
-                "ThunderstormProbability_DailyMax (pct);\n"
-                "WindDirection_DailyAvg (Deg);\n"
-                "WindGust_DailyMax (m/s);\n"
-                "WindSpeed_DailyAvg (m/s);\n"
-                "WindSpeed_DailyMax (m/s);\n"
-                "WindSpeed_DailyMin (m/s);\n"
-                "WindDirection_DailyAvg;\n"
-                "Soilmoisture_0to10cm_DailyMax (vol%);\n"
-                "Soilmoisture_0to10cm_DailyAvg (vol%);\n"
-                "Soilmoisture_0to10cm_DailyMin (vol%);\n"
-                "Soiltemperature_0to10cm_DailyMax (C);\n"
-                "Soiltemperature_0to10cm_DailyAvg (C);\n"
-                "Soiltemperature_0to10cm_DailyMin (C);\n"
-                "Referenceevapotranspiration_DailySum (mm)"
-            ),
+            "measureLabel": build_measure_label(required_labels()),
             "ApiKey": API_KEY
         }
     },
 }
 
-def add_extra_data(sample_daily_data):
-    extra_data = {
-        "Growth Efficiency": compute_growth_efficiency(sample_daily_data),
-        "Water Efficiency": compute_water_efficiency(sample_daily_data),
-        "Rainfall Utilization": compute_rainfall_utilization(sample_daily_data),
-        "Heat Stress Outlook": compute_heat_stress_outlook(sample_daily_data),
-        "Seasonal Water Use Comparison": compute_seasonal_water_use_comparison(sample_daily_data, irrigation_method_data=0.5),
-        "Yield Prediction": compute_yield_prediction(sample_daily_data),
-        "Market Price Forecast": compute_market_price_forecast(None),
-        "Harvest Timing Recommendation": compute_harvest_timing_recommendation(sample_daily_data),
-        "Labor & Machinery Cost Insights": compute_labor_machinery_cost_insights("input", "regional"),
-        "Resource Efficiency": compute_resource_efficiency(sample_daily_data, irrigation_method_data=0.5),
-        "Recommended Biological Products": compute_recommended_biological_products(sample_daily_data),
-        "Pest & Disease Alert": compute_pest_disease_alert(sample_daily_data),
-        "Frost Risk": compute_frost_risk(sample_daily_data),
-        "Irrigation Risk": compute_irrigation_risk(sample_daily_data),
-        "Soil Protection Recommendations": compute_soil_protection_recommendations(sample_daily_data)
-    }
-    return extra_data
-
-def fetch_all_data(id, longitude, latitude):
-    """Fetch data from endpoints, compute extra insights, and update the database."""
+def add_extra_data(sample_daily_data, previous_data=None, baselines=None):
+    """Compute every enabled insight from the registry for one set of daily data."""
+    return compute_insights(sample_daily_data, previous_data=previous_data, baselines=baselines)
+
+def add_extra_data_batch(daily_rows, baselines=None):
+    """Compute add_extra_data for many farms at once using the vectorized engine."""
+    names = [insight.name for insight in enabled_insights()]
+    return compute_insights_batch(daily_rows, names=names, baselines=baselines)
+
+async def fetch_forecast(longitude, latitude, client=forecast_http_client):
+    """Fetch the raw response of every endpoint for one set of coordinates."""
     results = {}
     # Loop over endpoints (even though it looks like you have one endpoint defined)
     for key, endpoint in endpoints.items():
-        url = BASE_URL + endpoint["path"]
         # Copy the default params and update with dynamic coordinates
         params = endpoint.get("params", {}).copy()
         params["longitude"] = longitude
         params["latitude"] = latitude
-        
+
+        cached = await forecast_cache.aget(endpoint["path"], params)
+        if cached is not None:
+            results[key] = cached
+            continue
+
         try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            results[key] = response.json()
+            results[key] = await client.get_json(endpoint["path"], params=params)
+            await forecast_cache.aset(endpoint["path"], params, results[key])
         except Exception as e:
-            logger.error("Error fetching data from %s: %s", url, e)
+            logger.error("Error fetching data from %s: %s", endpoint["path"], e)
             results[key] = None
 
     logger.info(f"Raw results: {results}")
+    return results
 
+
+def forecast_daily(results):
+    """Per-label, per-day aggregates of the short range forecast."""
     # Ensure that you aggregate data from the correct key. For example, if your endpoint returns hourly data under key "short_range_forecast":
-    hourly_data = results.get("short_range_forecast", [])
-    aggregated_data = aggregate_hourly_to_daily(hourly_data)
-    
+    hourly_data = results.get("short_range_forecast") or []
+    return aggregate_forecast(hourly_data)
+
+
+def current_values(aggregated_data):
+    """Label values and numeric insight scores of one result, keyed like the history store."""
+    values = {}
+    for key, value in aggregated_data.items():
+        if isinstance(value, (int, float)):
+            values[key] = value
+        elif isinstance(value, dict):
+            values.update({k: v for k, v in value.items() if k.endswith(" Score") and isinstance(v, (int, float))})
+    return values
+
+
+def build_forecast_data(results, previous_data=None, baselines=None):
+    """
+    Aggregate raw endpoint results and compute the extra insights on top.
+    Insights whose inputs match previous_data are reused instead of recomputed;
+    baselines are the tile's history averages (see insight_baselines).
+    """
+    daily = forecast_daily(results)
+    label_values = daily.horizon_means()
     # Compute extra insights based on the aggregated data.
-    extra_data = add_extra_data(aggregated_data)
+    extra_data = add_extra_data(label_values, previous_data=previous_data, baselines=baselines)
+    return assemble_forecast_data(daily, label_values, extra_data, baselines)
+
+
+def build_forecast_data_batch(results_list, baselines=None):
+    """build_forecast_data for many forecasts, with the insights computed in one vectorized pass."""
+    baselines = baselines or [None] * len(results_list)
+    dailies = [forecast_daily(results) for results in results_list]
+    label_values = [daily.horizon_means() for daily in dailies]
+    extra_data = add_extra_data_batch(label_values, baselines)
+    return [assemble_forecast_data(daily, values, extra_data[i], baselines[i])
+            for i, (daily, values) in enumerate(zip(dailies, label_values))]
+
+
+def assemble_forecast_data(daily, label_values, extra_data, baselines=None):
+    """One forecast's api_data: label values, extra insights, the daily series and fingerprints."""
+    aggregated_data = dict(label_values)
     # Update the aggregated_data dictionary with the extra insights.
     aggregated_data.update(extra_data)
+    # Keep the per-day breakdown next to the horizon values for storage and the frontend.
+    aggregated_data["Daily Series"] = daily.to_dict()
+
+    # Fingerprint every stored group so refreshes can tell exactly what changed.
+    # INPUTS_FINGERPRINT covers the top-level label values, which have no entry of their own.
+    fingerprints = insight_fingerprints(label_values, baselines=baselines)
+    fingerprints[INPUTS_FINGERPRINT] = fingerprint(label_values)
+    fingerprints["Daily Series"] = fingerprint(aggregated_data["Daily Series"])
+    aggregated_data[FINGERPRINT_KEY] = fingerprints
     
     logger.info(f"Aggregated data with extra insights: {aggregated_data}")
+    return aggregated_data
 
-    # Update the database: update if data exists, otherwise insert new data.
-    try:
-        if my_farmer_db.get_api_data_by_id(id):
-            my_farmer_db.update_api_data(id, aggregated_data)
+
+def changed_fields(aggregated_data, stored_fingerprints):
+    """
+    Return the part of aggregated_data whose fingerprints differ from the stored ones,
+    or None when nothing changed and the farm's row can be left alone. Registered
+    insights that are stored but no longer enabled map to None, which merge_api_data
+    removes. Other groups missing from this run (benchmarks after a transient
+    history error) keep their stored values and fingerprints.
+    """
+    fingerprints = dict(aggregated_data[FINGERPRINT_KEY])
+    removed = []
+    for group, stored in stored_fingerprints.items():
+        if group in fingerprints:
+            continue
+        if group in INSIGHTS:
+            removed.append(group)
         else:
-            my_farmer_db.insert_api_data(id, aggregated_data)
-    except Exception as e:
-        logger.error("Error updating/inserting data for id %s: %s", id, e)
-    
-    return aggregated_data
+            fingerprints[group] = stored
+    if stored_fingerprints == fingerprints:
+        return None
+    patch = {FINGERPRINT_KEY: fingerprints}
+    for key, value in aggregated_data.items():
+        if key == FINGERPRINT_KEY:
+            continue
+        group = key if key in fingerprints else INPUTS_FINGERPRINT
+        if stored_fingerprints.get(group) != fingerprints[group]:
+            patch[key] = value
+    for group in removed:
+        patch[group] = None
+    return patch
 
 
-def start_scheduler(id, longitude, latitude):
-    """Run the scheduled job in a loop."""
-    # For testing, run every 10 seconds (change back to 1 hour for production)
-    fetch_all_data(id, longitude, latitude)
+# Last result per tile, so the next refresh only recomputes insights whose inputs changed.
+_previous_tile_data = {}
 
-    schedule.every(1).hour.do(fetch_all_data, id, longitude, latitude)
-    logger.info("Scheduler started with id=%s, longitude=%s, latitude=%s", id, longitude, latitude)
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
 
+async def refresh_tile(tile, farm_ids):
+    """
+    Fetch the forecast for one grid tile once and fan the result out to every farm in it.
+    """
+    longitude, latitude = tile
+    results = await fetch_forecast(longitude, latitude)
+    if not any(results.values()):
+        # Keep the last good insights rather than overwriting them with an empty forecast.
+        logger.warning("No forecast data for tile %s, keeping stored insights", tile)
+        return None
+    previous_data = _previous_tile_data.get(tile)
+    try:
+        # Baselines and benchmarks compare against history up to yesterday, so the
+        # new issue is appended afterwards.
+        history = await asyncio.to_thread(tile_history, tile)
+    except Exception as e:
+        logger.error("Error loading history for tile %s: %s", tile, e)
+        history = None
+    baselines = insight_baselines(history) if history is not None else None
+    # Aggregation and insights are CPU-bound; keep them off the event loop.
+    aggregated_data = await asyncio.to_thread(build_forecast_data, results, previous_data, baselines)
 
+    try:
+        if history is not None:
+            benchmarks = historical_benchmarks(history, current_values(aggregated_data))
+            aggregated_data["Historical Benchmarks"] = benchmarks
+            aggregated_data[FINGERPRINT_KEY]["Historical Benchmarks"] = fingerprint(benchmarks)
+        series_fingerprint = aggregated_data[FINGERPRINT_KEY]["Daily Series"]
+        if previous_data is None or previous_data[FINGERPRINT_KEY].get("Daily Series") != series_fingerprint:
+            await asyncio.to_thread(append_history, tile, forecast_daily(results))
+            await my_async_farmer_db.insert_forecast_archive(tile_key(tile), results)
+    except Exception as e:
+        logger.error("Error updating history for tile %s: %s", tile, e)
+    _previous_tile_data[tile] = aggregated_data
+
+    try:
+        stored = await my_async_farmer_db.get_api_data_fingerprints(farm_ids)
+    except Exception as e:
+        logger.error("Error reading fingerprints for tile %s: %s", tile, e)
+        stored = {}
 
+    records = []
+    for id in farm_ids:
+        patch = changed_fields(aggregated_data, stored.get(str(id)) or {})
+        if patch is not None:
+            records.append((id, patch))
+    # Patches from many tiles are merged into the table in bulk.
+    await api_data_writer.add(records)
+    logger.info("Tile %s: %d of %d farms changed", tile, len(records), len(farm_ids))
+    return aggregated_data
+
+
+async def fetch_all_data(id, longitude, latitude):
+    """Fetch data from endpoints, compute extra insights, and update the database."""
+    return await refresh_tile(snap_to_tile(longitude, latitude), [id])
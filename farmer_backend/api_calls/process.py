@@ -1,10 +1,20 @@
-def compute_growth_efficiency(daily_data):
+from api_calls.registry import register_insight
+
+
+@register_insight(
+    "Growth Efficiency",
+    inputs=["TempAir_DailyAvg", "GlobalRadiation_DailySum", "Soilmoisture_0to10cm_DailyAvg"],
+    outputs=["Growth Efficiency Score", "Interpretation"],
+    baseline="Growth Efficiency Score",
+)
+def compute_growth_efficiency(daily_data, baseline=None):
     """
     🌱 Growth Efficiency
     Data Source: TempAir_DailyAvg (C), GlobalRadiation_DailySum (Wh/m2),
-                 Soilmoisture_0to10cm_DailyAvg (vol%)
+                 Soilmoisture_0to10cm_DailyAvg (vol%), daily history of this score
     Calculation & Interpretation:
-      Compare growth conditions (heat, sunlight, moisture) to historical benchmarks.
+      Compare growth conditions (heat, sunlight, moisture) to historical benchmarks:
+      the tile's recent average score (baseline), or 50 while it has no history.
     """
     try:
         temp_avg = float(daily_data.get("TempAir_DailyAvg", 0))
@@ -15,41 +25,16 @@ def compute_growth_efficiency(daily_data):
 
     # Example heuristic: weighted sum normalized to a 0-100 scale.
     score = (temp_avg / 40 * 0.3 + global_rad / 1000 * 0.4 + soilmoisture_avg / 100 * 0.3) * 100
-    interpretation = "Above benchmark" if score > 50 else "Below benchmark"
+    benchmark = 50 if baseline is None else baseline
+    interpretation = "Above benchmark" if score > benchmark else "Below benchmark"
     return {"Growth Efficiency Score": round(score, 1), "Interpretation": interpretation}
 
 
-def aggregate_hourly_to_daily(hourly_data):
-    """
-    Convert a list of hourly data dictionaries into a single dictionary
-    by averaging the values for each measure label.
-    
-    Expects each item in hourly_data to have keys:
-      - 'measureLabel'
-      - 'value'
-    """
-    aggregated = {}
-    counts = {}
-    for entry in hourly_data:
-        label = entry.get('measureLabel', '').strip()
-        value_str = entry.get('value', '0')
-        try:
-            value = float(value_str)
-        except Exception:
-            value = 0.0
-        # Aggregate the values (summing and counting for average)
-        if label in aggregated:
-            aggregated[label] += value
-            counts[label] += 1
-        else:
-            aggregated[label] = value
-            counts[label] = 1
-    # Compute the average for each label
-    for label in aggregated:
-        aggregated[label] /= counts[label]
-    return aggregated
-
-
+@register_insight(
+    "Water Efficiency",
+    inputs=["Evapotranspiration_DailySum", "Precip_DailySum", "Soilmoisture_0to10cm_DailyAvg"],
+    outputs=["Water Efficiency Score", "Interpretation"],
+)
 def compute_water_efficiency(daily_data):
     """
     💧 Water Efficiency
@@ -72,6 +57,11 @@ def compute_water_efficiency(daily_data):
     return {"Water Efficiency Score": round(efficiency, 2), "Interpretation": interpretation}
 
 
+@register_insight(
+    "Rainfall Utilization",
+    inputs=["Precip_DailySum", "Soilmoisture_0to10cm_DailyAvg", "Evapotranspiration_DailySum"],
+    outputs=["Rainfall Utilization Score", "Interpretation"],
+)
 def compute_rainfall_utilization(daily_data):
     """
     🌧 Rainfall Utilization
@@ -92,6 +82,11 @@ def compute_rainfall_utilization(daily_data):
     return {"Rainfall Utilization Score": round(utilization, 1), "Interpretation": interpretation}
 
 
+@register_insight(
+    "Heat Stress Outlook",
+    inputs=["TempAir_DailyMax", "TempAir_DailyMin", "HumidityRel_DailyAvg", "WindSpeed_DailyAvg"],
+    outputs=["Heat Stress Outlook Score", "Interpretation"],
+)
 def compute_heat_stress_outlook(daily_data):
     """
     🌡 Heat Stress Outlook
@@ -114,6 +109,12 @@ def compute_heat_stress_outlook(daily_data):
     return {"Heat Stress Outlook Score": round(stress, 1), "Interpretation": interpretation}
 
 
+@register_insight(
+    "Seasonal Water Use Comparison",
+    inputs=["Evapotranspiration_DailySum", "Precip_DailySum"],
+    params={"irrigation_method_data": 0.5},
+    outputs=["Seasonal Water Use Comparison Score", "Interpretation"],
+)
 def compute_seasonal_water_use_comparison(daily_data, irrigation_method_data=0):
     """
     📉 Seasonal Water Use Comparison
@@ -133,6 +134,11 @@ def compute_seasonal_water_use_comparison(daily_data, irrigation_method_data=0):
     return {"Seasonal Water Use Comparison Score": round(seasonal_efficiency, 2), "Interpretation": interpretation}
 
 
+@register_insight(
+    "Yield Prediction",
+    inputs=["TempAir_DailyAvg", "GlobalRadiation_DailySum", "Soilmoisture_0to10cm_DailyAvg"],
+    outputs=["Yield Prediction Score", "Interpretation"],
+)
 def compute_yield_prediction(daily_data):
     """
     🌾 Yield Prediction (Business Insight)
@@ -153,6 +159,12 @@ def compute_yield_prediction(daily_data):
     return {"Yield Prediction Score": round(yield_score, 1), "Interpretation": interpretation}
 
 
+@register_insight(
+    "Market Price Forecast",
+    inputs=[],
+    params={"external_market_data": None},
+    outputs=["Market Price Forecast"],
+)
 def compute_market_price_forecast(external_market_data):
     """
     💰 Market Price Forecast (Business Insight)
@@ -165,6 +177,11 @@ def compute_market_price_forecast(external_market_data):
     return {"Market Price Forecast": forecast}
 
 
+@register_insight(
+    "Harvest Timing Recommendation",
+    inputs=["TempAir_DailyAvg", "Precip_DailySum", "WindSpeed_DailyAvg", "HumidityRel_DailyAvg"],
+    outputs=["Harvest Timing Recommendation Score", "Interpretation"],
+)
 def compute_harvest_timing_recommendation(daily_data):
     """
     ⏳ Harvest Timing Recommendation (Business Insight)
@@ -186,6 +203,12 @@ def compute_harvest_timing_recommendation(daily_data):
     return {"Harvest Timing Recommendation Score": round(timing_score, 2), "Interpretation": interpretation}
 
 
+@register_insight(
+    "Labor & Machinery Cost Insights",
+    inputs=[],
+    params={"user_input": "input", "regional_data": "regional"},
+    outputs=["Labor & Machinery Cost Insights"],
+)
 def compute_labor_machinery_cost_insights(user_input, regional_data):
     """
     🚜 Labor & Machinery Cost Insights (Business Insight)
@@ -198,6 +221,12 @@ def compute_labor_machinery_cost_insights(user_input, regional_data):
     return {"Labor & Machinery Cost Insights": insights}
 
 
+@register_insight(
+    "Resource Efficiency",
+    inputs=["Evapotranspiration_DailySum", "Precip_DailySum"],
+    params={"irrigation_method_data": 0.5},
+    outputs=["Resource Efficiency Score", "Interpretation"],
+)
 def compute_resource_efficiency(daily_data, irrigation_method_data=0):
     """
     🏭 Resource Efficiency (Business Insight)
@@ -216,6 +245,11 @@ def compute_resource_efficiency(daily_data, irrigation_method_data=0):
     return {"Resource Efficiency Score": round(resource_efficiency, 2), "Interpretation": interpretation}
 
 
+@register_insight(
+    "Recommended Biological Products",
+    inputs=["TempAir_DailyAvg", "Precip_DailySum", "HumidityRel_DailyAvg", "Soilmoisture_0to10cm_DailyAvg"],
+    outputs=["Recommended Biological Products"],
+)
 def compute_recommended_biological_products(daily_data):
     """
     🛡 Recommended Biological Products (Protection Insight)
@@ -237,6 +271,11 @@ def compute_recommended_biological_products(daily_data):
     return {"Recommended Biological Products": recommendation}
 
 
+@register_insight(
+    "Pest & Disease Alert",
+    inputs=["TempAir_DailyAvg", "HumidityRel_DailyAvg", "WindSpeed_DailyAvg", "Precip_DailySum"],
+    outputs=["Pest & Disease Alert Score", "Interpretation"],
+)
 def compute_pest_disease_alert(daily_data):
     """
     🐛 Pest & Disease Alert (Protection Insight)
@@ -258,6 +297,11 @@ def compute_pest_disease_alert(daily_data):
     return {"Pest & Disease Alert Score": round(risk, 2), "Interpretation": interpretation}
 
 
+@register_insight(
+    "Frost Risk",
+    inputs=["TempAir_DailyMin", "Cloudcover_DailyAvg", "WindSpeed_DailyAvg"],
+    outputs=["Frost Risk Score", "Interpretation"],
+)
 def compute_frost_risk(daily_data):
     """
     ⚠️ Frost Risk (Protection Insight)
@@ -278,6 +322,11 @@ def compute_frost_risk(daily_data):
     return {"Frost Risk Score": round(risk, 2), "Interpretation": interpretation}
 
 
+@register_insight(
+    "Irrigation Risk",
+    inputs=["Soilmoisture_0to10cm_DailyAvg", "Referenceevapotranspiration_DailySum", "Precip_DailySum"],
+    outputs=["Irrigation Risk Score", "Interpretation"],
+)
 def compute_irrigation_risk(daily_data):
     """
     💦 Irrigation Risk (Protection Insight)
@@ -298,6 +347,11 @@ def compute_irrigation_risk(daily_data):
     return {"Irrigation Risk Score": round(risk, 2), "Interpretation": interpretation}
 
 
+@register_insight(
+    "Soil Protection Recommendations",
+    inputs=["Soilmoisture_0to10cm_DailyAvg", "Soiltemperature_0to10cm_DailyAvg", "Evapotranspiration_DailySum"],
+    outputs=["Soil Protection Recommendations"],
+)
 def compute_soil_protection_recommendations(daily_data):
     """
     ✅ Soil Protection Recommendations (Protection Insight)
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+
+# Comma-separated insight names to compute; empty means every registered insight.
+ENABLED_INSIGHTS = [name.strip() for name in os.getenv("ENABLED_INSIGHTS", "").split(",") if name.strip()]
+
+# api_data key holding {insight name: fingerprint of the inputs it was computed from}.
+FINGERPRINT_KEY = "_fingerprints"
+
+
+def fingerprint(value):
+    """Short stable hash of any JSON-serialisable value."""
+    raw = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+class Insight:
+    """
+    One registered insight: the function that computes it, the measure labels it
+    reads, the fixed keyword parameters it is called with and the keys it returns.
+    An insight with a baseline (a daily history series, usually its own score)
+    is also passed that series' recent average as baseline=, or None without history.
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, outputs=(), baseline=None):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.params = dict(params or {})
+        self.outputs = tuple(outputs)
+        self.baseline = baseline
+        # Editing the formula changes the bytecode, which invalidates stored results.
+        code = func.__code__
+        self.code_fingerprint = fingerprint([code.co_code.hex(), repr(code.co_consts)])
+
+    def compute(self, daily_data, baselines=None):
+        params = self.params
+        if self.baseline:
+            params = {**params, "baseline": (baselines or {}).get(self.baseline)}
+        # Insights without measure inputs (market, labor) only take their parameters.
+        if self.inputs:
+            return self.func(daily_data, **params)
+        return self.func(**params)
+
+    def fingerprint(self, daily_data, baselines=None):
+        """Hash of everything the result depends on: the formula, its parameters, input values and baseline."""
+        parts = [self.name, self.code_fingerprint, self.params, [daily_data.get(label) for label in self.inputs]]
+        if self.baseline:
+            parts.append((baselines or {}).get(self.baseline))
+        return fingerprint(parts)
+
+
+# name -> Insight, in registration order (the order insights appear in api_data).
+INSIGHTS = {}
+
+
+def register_insight(name, inputs=(), params=None, outputs=(), baseline=None):
+    """Decorator that adds a compute_* function to the insight registry."""
+    def decorator(func):
+        INSIGHTS[name] = Insight(name, func, inputs=inputs, params=params, outputs=outputs, baseline=baseline)
+        return func
+    return decorator
+
+
+def enabled_insights():
+    if not ENABLED_INSIGHTS:
+        return list(INSIGHTS.values())
+    unknown = set(ENABLED_INSIGHTS) - set(INSIGHTS)
+    if unknown:
+        raise ValueError(f"Unknown insights in ENABLED_INSIGHTS: {sorted(unknown)}")
+    return [INSIGHTS[name] for name in ENABLED_INSIGHTS]
+
+
+def required_labels(insights=None):
+    """Union of the measure labels read by the given (default: enabled) insights."""
+    insights = enabled_insights() if insights is None else insights
+    labels = []
+    for insight in insights:
+        for label in insight.inputs:
+            if label not in labels:
+                labels.append(label)
+    return labels
+
+
+def baseline_series(insights=None):
+    """History series whose averages the given (default: enabled) insights compare against."""
+    insights = enabled_insights() if insights is None else insights
+    return [insight.baseline for insight in insights if insight.baseline]
+
+
+def insight_fingerprints(daily_data, insights=None, baselines=None):
+    insights = enabled_insights() if insights is None else insights
+    return {insight.name: insight.fingerprint(daily_data, baselines) for insight in insights}
+
+
+def compute_insights(daily_data, previous_data=None, insights=None, baselines=None):
+    """
+    Compute every enabled insight for one set of daily data.
+
+    baselines maps history series to their recent average (see baseline_series).
+    When previous_data (an earlier result carrying FINGERPRINT_KEY) is given,
+    insights whose input fingerprint is unchanged reuse their previous result.
+    """
+    insights = enabled_insights() if insights is None else insights
+    previous_data = previous_data or {}
+    previous_fingerprints = previous_data.get(FINGERPRINT_KEY) or {}
+    results = {}
+    for insight in insights:
+        if (insight.name in previous_data
+                and previous_fingerprints.get(insight.name) == insight.fingerprint(daily_data, baselines)):
+            results[insight.name] = previous_data[insight.name]
+        else:
+            results[insight.name] = insight.compute(daily_data, baselines)
+    return results
@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import os
+import random
+import time
+from models import my_farmer_db, my_async_farmer_db, PAGE_SIZE_MAX
+from tools import logger
+from api_calls.main import refresh_tile
+from api_calls.http_client import forecast_http_client
+from api_calls.writer import api_data_writer
+from api_calls.tiles import snap_to_tile
+
+REFRESH_INTERVAL = float(os.getenv("FORECAST_REFRESH_SECONDS", 3600))
+REFRESH_JITTER = float(os.getenv("FORECAST_REFRESH_JITTER_SECONDS", 300))
+SCHEDULER_WORKERS = int(os.getenv("FORECAST_SCHEDULER_WORKERS", 8))
+
+
+class ForecastScheduler:
+    """
+    One process-wide scheduler for every farm's forecast refresh.
+
+    Farms are grouped by forecast tile, and tiles live in a min-heap ordered by
+    their next due time. A single dispatcher task sleeps until the earliest tile is
+    due and hands it to a fixed pool of worker tasks, which fetch it once for all
+    of its farms. The idle footprint is the same for ten farms or ten thousand.
+
+    Farms created, moved or deleted by any worker reach the scheduler through the
+    users change notifications of farmer_db, so only one process needs to run it.
+    """
+
+    def __init__(self, interval=REFRESH_INTERVAL, jitter=REFRESH_JITTER, workers=SCHEDULER_WORKERS):
+        self.interval = interval
+        self.jitter = jitter
+        self.workers = workers
+        self._heap = []      # (due_at, sequence, tile)
+        self._tiles = {}     # tile -> (sequence, set of farm ids)
+        self._farm_tiles = {}  # farm_id -> tile
+        self._sequence = 0
+        self._queue = None
+        self._wakeup = None
+        self._tasks = []
+        self._loop = None
+        self._subscribed = False
+        self._sync_tasks = set()
+
+    def _next_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return now + self.interval + random.uniform(-self.jitter, self.jitter)
+
+    def add_farm(self, id, longitude, latitude, due_at=None):
+        """Schedule a farm. By default its tile is refreshed right away."""
+        try:
+            tile = snap_to_tile(longitude, latitude)
+        except (TypeError, ValueError):
+            logger.warning("Skipping farm %s with invalid coordinates %s, %s", id, longitude, latitude)
+            return
+        id = str(id)
+        if self._farm_tiles.get(id) not in (None, tile):
+            self.remove_farm(id)
+        self._farm_tiles[id] = tile
+
+        if tile in self._tiles and due_at is not None:
+            # The tile is already scheduled; the farm simply joins its next refresh.
+            self._tiles[tile][1].add(id)
+            return
+        farms = self._tiles[tile][1] if tile in self._tiles else set()
+        farms.add(id)
+        self._schedule_tile(tile, farms, time.monotonic() if due_at is None else due_at)
+
+    def remove_farm(self, id):
+        tile = self._farm_tiles.pop(str(id), None)
+        if tile in self._tiles:
+            farms = self._tiles[tile][1]
+            farms.discard(str(id))
+            if not farms:
+                # The heap entry for an empty tile is skipped when it is popped.
+                del self._tiles[tile]
+
+    def _schedule_tile(self, tile, farms, due_at):
+        self._sequence += 1
+        # Any older heap entry for this tile is now stale and ignored when popped.
+        self._tiles[tile] = (self._sequence, farms)
+        heapq.heappush(self._heap, (due_at, self._sequence, tile))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        """Load every registered farm and start the dispatcher and worker tasks."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.workers)
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        # Subscribe before loading, so farms written meanwhile are not missed.
+        if not self._subscribed:
+            my_farmer_db.subscribe(self._on_change)
+            self._subscribed = True
+
+        await self._load_farms()
+        logger.info("Forecast scheduler loaded %d farms in %d tiles", len(self._farm_tiles), len(self._tiles))
+
+        self._tasks = [asyncio.create_task(self._dispatch())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def _load_farms(self, resync=False):
+        """
+        Add every registered farm. On a resync, also drop the farms that no longer
+        exist; farms already scheduled keep their place.
+        """
+        # Page through the farms so start-up memory does not grow with the users table.
+        now = time.monotonic()
+        seen = set()
+        after = None
+        while True:
+            users, after = await my_async_farmer_db.get_users_page(
+                columns=("id", "longitude", "latitude"), limit=PAGE_SIZE_MAX, after=after)
+            for user in users:
+                seen.add(str(user["id"]))
+                # Spread the first cycle over one interval instead of refreshing everyone at boot.
+                self.add_farm(user["id"], user["longitude"], user["latitude"],
+                              due_at=now + random.uniform(0, self.interval))
+            if after is None:
+                break
+        if resync:
+            for id in set(self._farm_tiles) - seen:
+                self.remove_farm(id)
+
+    def _on_change(self, table, id):
+        # Runs on the farmer_db listener thread. _loop is set before start() loads the
+        # farms, so changes made while they are paged through are applied too.
+        if table in ("users", "*") and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._start_sync, id)
+
+    def _start_sync(self, id):
+        task = asyncio.create_task(self._sync_farm(id))
+        self._sync_tasks.add(task)
+        task.add_done_callback(self._sync_tasks.discard)
+
+    async def _sync_farm(self, id):
+        """Bring one farm (or, for "*", every farm) in line with the users table."""
+        try:
+            if id == "*":
+                await self._load_farms(resync=True)
+                return
+            user = await my_async_farmer_db.get_user_by_id(id)
+            if user is None:
+                self.remove_farm(id)
+                return
+            try:
+                tile = snap_to_tile(user["longitude"], user["latitude"])
+            except (TypeError, ValueError):
+                tile = None
+            # A new or moved farm is refreshed right away; other edits leave the schedule alone.
+            if tile is None or self._farm_tiles.get(str(id)) != tile:
+                self.remove_farm(id)
+                self.add_farm(id, user["longitude"], user["latitude"])
+        except Exception as e:
+            logger.error("Error syncing farm %s with the forecast scheduler: %s", id, e)
+
+    async def stop(self):
+        self._loop = None
+        for task in self._tasks + list(self._sync_tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._sync_tasks, return_exceptions=True)
+        self._tasks = []
+        await api_data_writer.flush()
+        await forecast_http_client.aclose()
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            due_at, sequence, tile = self._heap[0]
+            delay = due_at - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            entry = self._tiles.get(tile)
+            if entry is None or entry[0] != sequence:
+                continue
+            # Blocks when every worker is busy, which keeps the backlog in the heap.
+            await self._queue.put((sequence, tile, list(entry[1])))
+
+    async def _work(self):
+        while True:
+            sequence, tile, farm_ids = await self._queue.get()
+            try:
+                await refresh_tile(tile, farm_ids)
+            except Exception as e:
+                logger.error("Scheduled refresh failed for tile %s: %s", tile, e)
+            finally:
+                self._queue.task_done()
+                entry = self._tiles.get(tile)
+                if entry is not None and entry[0] == sequence:
+                    self._schedule_tile(tile, entry[1], self._next_due())
+
+
+forecast_scheduler = ForecastScheduler()
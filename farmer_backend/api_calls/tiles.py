@@ -0,0 +1,22 @@
+import math
+import os
+
+# Size of a forecast tile in degrees. Farms in the same tile share one upstream request.
+# Set to 0 to disable snapping and fetch at each farm's exact coordinates.
+TILE_DEGREES = float(os.getenv("FORECAST_TILE_DEGREES", 0.05))
+
+
+def snap_to_tile(longitude, latitude, degrees=TILE_DEGREES):
+    """
+    Return the centre (longitude, latitude) of the grid cell containing the coordinates.
+
+    The result is used both as the request coordinates and as the tile's identity,
+    so it is rounded to keep float noise from splitting one cell into two keys.
+    """
+    longitude = float(longitude)
+    latitude = float(latitude)
+    if degrees <= 0:
+        return round(longitude, 6), round(latitude, 6)
+    lon_centre = (math.floor(longitude / degrees) + 0.5) * degrees
+    lat_centre = (math.floor(latitude / degrees) + 0.5) * degrees
+    return round(lon_centre, 6), round(lat_centre, 6)
@@ -0,0 +1,81 @@
+import asyncio
+import os
+from models import my_async_farmer_db
+from tools import logger
+
+API_DATA_BATCH_SIZE = int(os.getenv("API_DATA_BATCH_SIZE", 500))
+API_DATA_BATCH_DELAY = float(os.getenv("API_DATA_BATCH_DELAY_SECONDS", 1.0))
+
+
+class ApiDataWriter:
+    """
+    Coalesces api_data patches from many tile refreshes into bulk merges.
+
+    Patches are buffered until batch_size farms are waiting or max_delay seconds
+    have passed since the first one, then written with one merge_api_data_many
+    statement. A refresh cycle over thousands of farms becomes a handful of
+    statements instead of one commit per farm. A later patch for the same farm
+    is folded into the pending one.
+    """
+
+    def __init__(self, batch_size=API_DATA_BATCH_SIZE, max_delay=API_DATA_BATCH_DELAY):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._pending = {}
+        self._timer = None
+        self._lock = None
+        self.statements = 0
+        self.written = 0
+
+    async def add(self, records):
+        """Queue (id, patch) pairs for writing."""
+        for id, patch in records:
+            id = str(id)
+            self._pending[id] = {**self._pending[id], **patch} if id in self._pending else patch
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+        elif self._pending and self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error("Error writing %d buffered api_data patches: %s", len(self._pending), e)
+            # The patches are back in the buffer; try again after another delay.
+            if self._pending and self._timer is None:
+                self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return
+            records, self._pending = list(self._pending.items()), {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            for i in range(0, len(records), self.batch_size):
+                batch = records[i:i + self.batch_size]
+                try:
+                    # Also rewrites the batch's insight_scores rows, in the same transaction.
+                    await my_async_farmer_db.merge_api_data_many(batch)
+                except Exception:
+                    self._restore(records[i:])
+                    raise
+                self.statements += 1
+                self.written += len(batch)
+
+    def _restore(self, records):
+        """Put unwritten records back, under any patch queued for the same farm since."""
+        for id, patch in records:
+            self._pending[id] = {**patch, **self._pending[id]} if id in self._pending else patch
+
+    def stats(self):
+        return {"pending": len(self._pending), "statements": self.statements, "written": self.written}
+
+
+api_data_writer = ApiDataWriter()
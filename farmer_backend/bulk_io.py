@@ -0,0 +1,34 @@
+"""
+Bulk import and export of farms (users) and their insights (api_data) with COPY.
+
+    python bulk_io.py export users users.csv
+    python bulk_io.py export api_data api_data.bin --format binary
+    python bulk_io.py import users users.csv
+
+Imports upsert by id, so re-importing an export restores it.
+"""
+import argparse
+import time
+from models import my_farmer_db, COPY_UPSERT_COLUMNS, COPY_FORMATS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of farm tables with COPY.")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("table", choices=sorted(COPY_UPSERT_COLUMNS))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=COPY_FORMATS, default="csv")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    if args.action == "export":
+        with open(args.path, "wb") as f:
+            rows = my_farmer_db.copy_export(args.table, f, format=args.format)
+    else:
+        with open(args.path, "rb") as f:
+            rows = my_farmer_db.copy_import(args.table, f, format=args.format)
+    print(f"{args.action.capitalize()}ed {rows} {args.table} rows in {time.monotonic() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Per-method query instrumentation for farmer_db.
+
+Every public farmer_db method is wrapped by instrument_methods, which records
+its latency in a fixed-bucket histogram together with call, error, statement and
+row counts. Each statement executed inside a method goes through an
+InstrumentedCursor. Statements slower than DB_SLOW_QUERY_MS are logged with
+their parameters redacted to their types, so personal data and API payloads
+never reach the logs.
+"""
+import functools
+import inspect
+import os
+import re
+import threading
+import time
+from tools.mylogger import logger
+
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+# Upper bounds, in milliseconds, of the latency histogram buckets.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+_local = threading.local()
+
+
+class MethodStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.statements = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+
+    def observe(self, elapsed_ms, error=False):
+        self.calls += 1
+        self.errors += error
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile call."""
+        rank = q * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return bound if bound != float("inf") else round(self.max_ms, 2)
+        return 0.0
+
+    def snapshot(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "statements": self.statements,
+            "rows": self.rows,
+            "mean_ms": round(self.total_ms / self.calls, 2) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 2),
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "histogram_ms": {("+Inf" if bound == float("inf") else str(bound)): count
+                             for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets)},
+        }
+
+
+class QueryMetrics:
+    """Process-wide registry of MethodStats keyed by farmer_db method name."""
+
+    def __init__(self, slow_query_ms=DB_SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = 0
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, method):
+        # Callers hold self._lock.
+        stats = self._methods.get(method)
+        if stats is None:
+            stats = self._methods[method] = MethodStats()
+        return stats
+
+    def record_call(self, method, elapsed_ms, error=False):
+        with self._lock:
+            self._stats(method).observe(elapsed_ms, error)
+
+    def record_statement(self, method, rows):
+        with self._lock:
+            stats = self._stats(method)
+            stats.statements += 1
+            stats.rows += max(rows, 0)
+
+    def record_slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    def record_rows(self, method, rows):
+        with self._lock:
+            self._stats(method).rows += rows
+
+    def snapshot(self):
+        with self._lock:
+            methods = {name: stats.snapshot() for name, stats in sorted(self._methods.items())}
+        return {"slow_query_ms": self.slow_query_ms, "slow_queries": self.slow_queries, "methods": methods}
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+            self.slow_queries = 0
+
+
+query_metrics = QueryMetrics()
+
+
+def current_method():
+    stack = getattr(_local, "methods", None)
+    return stack[-1] if stack else "internal"
+
+
+def redact(params):
+    """Replace every parameter value with its type (and size for sequences)."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: redact_value(value) for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [redact_value(value) for value in params]
+    return redact_value(params)
+
+
+def redact_value(value):
+    if value is None:
+        return None
+    name = type(value).__name__
+    if isinstance(value, (list, tuple)):
+        return f"<{name}[{len(value)}]>"
+    return f"<{name}>"
+
+
+def _statement_text(cursor, query):
+    if isinstance(query, bytes):
+        # Already merged with its values (execute_values): keep only the statement head.
+        query = query.decode(errors="replace")
+        query = re.split(r"\bVALUES\b", query, maxsplit=1, flags=re.IGNORECASE)[0] + " VALUES <redacted>"
+    elif not isinstance(query, str):
+        # psycopg2.sql.Composed needs a connection to render.
+        query = query.as_string(cursor.connection)
+    return re.sub(r"\s+", " ", query).strip()
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times every statement and logs the slow ones."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        # Settings such as itersize or autocommit belong to the wrapped cursor.
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def _timed(self, run, query, params):
+        started = time.perf_counter()
+        try:
+            return run()
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            method = current_method()
+            query_metrics.record_statement(method, self._cursor.rowcount)
+            if elapsed_ms >= query_metrics.slow_query_ms:
+                query_metrics.record_slow_query()
+                logger.warning("Slow query in farmer_db.%s (%.0f ms): %s params=%s",
+                               method, elapsed_ms, _statement_text(self._cursor, query), redact(params))
+
+    def execute(self, query, params=None):
+        return self._timed(lambda: self._cursor.execute(query, params), query, params)
+
+    def executemany(self, query, params_seq):
+        params_seq = list(params_seq)
+        return self._timed(lambda: self._cursor.executemany(query, params_seq), query, params_seq)
+
+    def copy_expert(self, sql, file, *args, **kwargs):
+        return self._timed(lambda: self._cursor.copy_expert(sql, file, *args, **kwargs), sql, None)
+
+
+class InstrumentedConnection:
+    """Connection proxy whose cursors are InstrumentedCursors."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        # Settings such as itersize or autocommit belong to the wrapped connection.
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+
+def _method_stack():
+    stack = getattr(_local, "methods", None)
+    if stack is None:
+        stack = _local.methods = []
+    return stack
+
+
+def _stream(method, generator):
+    """Time a streaming method until its caller has consumed (or closed) it."""
+    started = time.perf_counter()
+    rows = 0
+    error = False
+    try:
+        while True:
+            # Rows are fetched lazily, so statements run while the caller iterates.
+            stack = _method_stack()
+            stack.append(method)
+            try:
+                row = next(generator)
+            except StopIteration:
+                break
+            finally:
+                stack.pop()
+            rows += 1
+            yield row
+    except Exception:
+        error = True
+        raise
+    finally:
+        generator.close()
+        query_metrics.record_rows(method, rows)
+        query_metrics.record_call(method, (time.perf_counter() - started) * 1000, error)
+
+
+def instrumented(func):
+    """Record latency, errors and statements of one farmer_db method under its name."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = _method_stack()
+        stack.append(name)
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            query_metrics.record_call(name, (time.perf_counter() - started) * 1000, error=True)
+            raise
+        finally:
+            stack.pop()
+        if inspect.isgenerator(result):
+            return _stream(name, result)
+        query_metrics.record_call(name, (time.perf_counter() - started) * 1000)
+        return result
+
+    return wrapper
+
+
+def instrument_methods(cls):
+    """Class decorator: instrument every public method except the ones in cls.uninstrumented."""
+    skip = set(getattr(cls, "uninstrumented", ()))
+    for name, value in list(vars(cls).items()):
+        if name.startswith("_") or name in skip or not inspect.isfunction(value):
+            continue
+        setattr(cls, name, instrumented(value))
+    return cls
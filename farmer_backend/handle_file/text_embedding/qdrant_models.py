@@ -1,6 +1,7 @@
-from qdrant_client import QdrantClient
+import asyncio
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.models import VectorParams, Distance, PointStruct, Filter, FieldCondition, MatchValue
-from tools import get_openai_embeddings, QDRANT_CLIENT_HOST
+from tools import get_openai_embeddings, close_on_loop, QDRANT_CLIENT_HOST
 import uuid
 from celery import shared_task
 from qdrant_client.http.exceptions import ApiException
@@ -12,6 +13,22 @@ logger = logging.getLogger(__name__)
 def get_client():
     return QdrantClient(QDRANT_CLIENT_HOST)
 
+
+_async_client = None
+_async_client_loop = None
+
+
+def get_async_client():
+    """Shared AsyncQdrantClient for the running event loop, so searches do not block it."""
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        if _async_client is not None:
+            close_on_loop(_async_client_loop, _async_client.close)
+        _async_client = AsyncQdrantClient(QDRANT_CLIENT_HOST)
+        _async_client_loop = loop
+    return _async_client
+
 def create_or_get_collection(collection_name: str, vector_size: int):
     """Ensures the Qdrant collection exists, creating it if necessary."""
     client = get_client()
@@ -68,10 +85,11 @@ def upsert_task(chunks, source: str, collection_name: str):
         logger.error(f"Error upserting vectors: {e}")
 
 
-async def query(query: str, collection_name: str, top_k=5, source: str=None):
-    client = get_client()
-    # Generate the embedding for the query
-    embedding = await get_openai_embeddings([query])
+async def query(query: str, collection_name: str, top_k=5, source: str=None, embedding=None):
+    client = get_async_client()
+    # Generate the embedding for the query, unless the caller already has it
+    if embedding is None:
+        embedding = await get_openai_embeddings([query])
 
     # # Define a filter
     # my_filter = Filter(
@@ -83,15 +101,15 @@ async def query(query: str, collection_name: str, top_k=5, source: str=None):
     #     ]
     # )
     # Perform the search with filtering
-    results = client.search(
+    response = await client.query_points(
         collection_name=collection_name,
-        query_vector=embedding[0].tolist(),
+        query=embedding[0].tolist(),
         limit=top_k,
         with_payload=True,
         
-        # filter=my_filter,
+        # query_filter=my_filter,
     )
-    return results
+    return response.points
 
 def delete_collection(collection_name: str):
     client = get_client()
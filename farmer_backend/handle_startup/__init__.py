@@ -0,0 +1,2 @@
+from .main import on_startup, on_shutdown
+from .archiver import conversation_archiver
\ No newline at end of file
@@ -0,0 +1,57 @@
+import asyncio
+import os
+from models import my_async_farmer_db
+from tools import logger
+
+ARCHIVE_INTERVAL = float(os.getenv("CONVERSATION_ARCHIVE_INTERVAL_SECONDS", 3600))
+
+
+class ConversationArchiver:
+    """
+    Background task that moves idle conversations to compressed cold storage.
+
+    Every interval seconds it archives batches (see farmer_db.archive_idle_conversations)
+    until no idle conversation is left, so the hot conversations and messages
+    tables only hold recently active chats.
+    """
+
+    def __init__(self, interval=ARCHIVE_INTERVAL):
+        self.interval = interval
+        self.archived = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def archive_once(self):
+        archived = 0
+        while True:
+            count = await my_async_farmer_db.archive_idle_conversations()
+            archived += count
+            if not count:
+                break
+        self.archived += archived
+        return archived
+
+    async def _run(self):
+        while True:
+            try:
+                archived = await self.archive_once()
+                if archived:
+                    logger.info("Archived %d idle conversations", archived)
+            except Exception as e:
+                logger.error("Error archiving idle conversations: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {"running": self._task is not None, "archived": self.archived}
+
+
+conversation_archiver = ConversationArchiver()
@@ -0,0 +1,26 @@
+import os
+from models import my_farmer_db
+from api_calls import forecast_scheduler
+from handle_startup.archiver import conversation_archiver
+from tools import logger, openai_clients
+
+# Only one process should own the fleet refresh; set this to "false" on extra workers.
+FORECAST_SCHEDULER_ENABLED = os.getenv("FORECAST_SCHEDULER_ENABLED", "true").lower() == "true"
+# Archiving is safe from several processes at once, but one is enough.
+CONVERSATION_ARCHIVER_ENABLED = os.getenv("CONVERSATION_ARCHIVER_ENABLED", "true").lower() == "true"
+
+
+async def on_startup():
+    if FORECAST_SCHEDULER_ENABLED:
+        await forecast_scheduler.start()
+    else:
+        logger.info("Forecast scheduler disabled in this process")
+    if CONVERSATION_ARCHIVER_ENABLED:
+        conversation_archiver.start()
+
+
+async def on_shutdown():
+    await forecast_scheduler.stop()
+    await conversation_archiver.stop()
+    await openai_clients.aclose()
+    my_farmer_db.close()
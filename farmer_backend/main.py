@@ -1,17 +1,20 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from models import my_farmer_db
+from models import my_farmer_db, my_async_farmer_db
 from pydantic import BaseModel
+import asyncio
 import httpx
-from tools import logger, call_openai_api, OPENAI_API, predefined_questions, json_summary_plan_schema, summary_prompt
+from tools import logger, call_openai_api, stream_openai_api, get_openai_embeddings, SemanticCache, OPENAI_API, predefined_questions, json_summary_plan_schema, summary_prompt
+from tools.chat_context import build_prompt, messages_to_fold, messages_tokens, truncate_to_tokens
 from handle_file import add_to_qdrant, query, delete_document_from_collection, extract_text_from_file
 from typing import Optional
 import json
 import soundfile as sf
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import uuid
-from api_calls import start_scheduler
-import threading
+from api_calls import forecast_cache, api_data_writer
+from api_calls.registry import fingerprint, INSIGHTS, FINGERPRINT_KEY
+from handle_startup import on_startup, on_shutdown, conversation_archiver
 import uvicorn
 import json
 import numpy as np
@@ -19,13 +22,52 @@ import os
 
 import numpy as np
 
+# Most stored messages read back for a chat turn; the token budgets below usually bind first.
+CHAT_HISTORY_MESSAGES = int(os.getenv("CHAT_HISTORY_MESSAGES", 50))
+SYSTEM_MESSAGE = {"role": "system", "content": "You are a helpful assistant."}
+# Token budget of the whole prompt of a chat turn.
+CHAT_PROMPT_TOKENS = int(os.getenv("CHAT_PROMPT_TOKENS", 8000))
+# The farm's insights and the document context are each cut to this many tokens.
+CHAT_CONTEXT_MAX_TOKENS = int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", 1500))
+# api_data entries that are not insights: the per-day series, the history
+# comparisons and refresh bookkeeping, which would crowd the insights out of the budget.
+CHAT_INSIGHTS_EXCLUDED_KEYS = ("Daily Series", "Historical Benchmarks", FINGERPRINT_KEY)
+# Once the messages after the conversation summary exceed this many tokens, the
+# oldest of them are folded into the summary.
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", 4000))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", 600))
+CONVERSATION_SUMMARY_PROMPT = (
+    "You maintain the running summary of a conversation between a farmer and an agricultural "
+    "assistant. Update the summary with the new messages. Keep the farmer's facts, questions, "
+    "decisions and the advice given; drop small talk. Answer with the summary only, at most "
+    "{max_words} words."
+)
+# Per-stage limits, in seconds, on gathering a chat turn's context. The insights and
+# document context are optional: a stage that fails or runs over is left out.
+CHAT_HISTORY_TIMEOUT = float(os.getenv("CHAT_HISTORY_TIMEOUT_SECONDS", 5))
+CHAT_INSIGHTS_TIMEOUT = float(os.getenv("CHAT_INSIGHTS_TIMEOUT_SECONDS", 2))
+CHAT_CONTEXT_TIMEOUT = float(os.getenv("CHAT_CONTEXT_TIMEOUT_SECONDS", 3))
+# Semantic answer cache for the first question of a conversation, per farmer.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAXSIZE = int(os.getenv("ANSWER_CACHE_MAXSIZE", 10000))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 3600))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95))
+ANSWER_CACHE_MAX_PER_FARMER = int(os.getenv("ANSWER_CACHE_MAX_PER_FARMER", 100))
+
+answer_cache = SemanticCache(ANSWER_CACHE_MAXSIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY,
+                             ANSWER_CACHE_MAX_PER_FARMER)
+
 app = FastAPI()
+app.add_event_handler("startup", on_startup)
+app.add_event_handler("shutdown", on_shutdown)
 
 class Conversation(BaseModel):
     person_id: Optional[str] = None
     conversation_id: Optional[str] = None
     message: str
     context: Optional[str] = None
+    # Stream the answer as Server-Sent Events instead of returning it in one JSON body.
+    stream: bool = False
  
 
 class FileItem(BaseModel):
@@ -48,12 +90,122 @@ app.add_middleware(
     allow_headers=["*"],  
 )
 
-@app.post("/get_openai_answer")
-async def get_openai_answer(item: Conversation):
+async def optional_stage(stage, awaitable, timeout):
+    """Await one optional context stage; on failure or timeout log it and return None."""
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Chat context stage %s timed out after %.1fs", stage, timeout)
+    except Exception as e:
+        logger.warning("Chat context stage %s failed: %s", stage, e)
+    return None
+
+
+async def load_window(conversation_id):
+    if conversation_id is None:
+        return None
+    try:
+        # Only the summary and the latest messages are read, through the (conversation_id, seq) index.
+        return await asyncio.wait_for(
+            my_async_farmer_db.get_conversation_window(conversation_id, limit=CHAT_HISTORY_MESSAGES),
+            CHAT_HISTORY_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out loading the conversation.")
+
+
+class ChatTurn:
+    """Everything gathered for one chat turn before the model is called."""
+
+    def __init__(self, conversation_id, window, user_message, context_messages, context,
+                 tenant=None, embedding=None, snapshot=None):
+        self.conversation_id = conversation_id
+        # The farmer (person_id) the answer cache is scoped to.
+        self.tenant = tenant
+        self.is_new = window is None
+        self.summary = window["summary"] if window else None
+        # Stored system messages are left out: the system prompt is always sent first,
+        # and older turns' insights and context are superseded by this turn's.
+        self.history = [message for message in (window["messages"] if window else [])
+                        if message["role"] != "system"]
+        self.user_message = user_message
+        # Insights and document context for this turn only; they are not stored.
+        self.context_messages = context_messages
+        # Messages added in this turn; only these are written back.
+        self.new_messages = ([SYSTEM_MESSAGE] if self.is_new else []) + [user_message]
+        self.context = context
+        # Question embedding and hash of the insights and context the answer is based on,
+        # the lookup key of the answer cache.
+        self.embedding = embedding
+        self.snapshot = snapshot
+
+    @property
+    def conversation(self):
+        """The prompt: system prompt, summary, as many recent turns as fit, then this turn."""
+        head = [SYSTEM_MESSAGE]
+        if self.summary:
+            head.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        prompt, _ = build_prompt(head, self.history, [self.user_message] + self.context_messages,
+                                 CHAT_PROMPT_TOKENS)
+        return prompt
+
+    @property
+    def cacheable(self):
+        # Later turns depend on the conversation so far, so only opening questions are cached,
+        # and only for a known farmer: anonymous requests would share one cache.
+        return (ANSWER_CACHE_ENABLED and self.is_new and self.tenant is not None
+                and self.embedding is not None)
+
+
+def insights_message(api_data):
+    """
+    The farm's insights as one system message: the forecast label averages on one
+    line, then one line per insight in registry order. The budget is shared per
+    entry, so one large insight cannot push the others out.
+    """
+    data = (api_data or {}).get("api_data") or {}
+    labels = {key: value for key, value in data.items()
+              if isinstance(value, (int, float)) and not isinstance(value, bool)}
+    order = {name: i for i, name in enumerate(INSIGHTS)}
+    insights = sorted(((key, value) for key, value in data.items()
+                       if isinstance(value, dict) and key not in CHAT_INSIGHTS_EXCLUDED_KEYS),
+                      key=lambda item: order.get(item[0], len(order)))
+    if not labels and not insights:
+        return None
+    per_entry = CHAT_CONTEXT_MAX_TOKENS // (len(insights) + bool(labels))
+    lines = []
+    if labels:
+        lines.append(truncate_to_tokens(
+            "Forecast averages: " + ", ".join(f"{key}: {round(value, 2)}" for key, value in labels.items()),
+            per_entry))
+    for name, value in insights:
+        lines.append(truncate_to_tokens(f"{name}: {json.dumps(value, default=str)}", per_entry))
+    return "Here are the insights:\n" + "\n".join(lines)
+
+
+async def embed_question(message):
+    return (await get_openai_embeddings([message]))[0]
+
+
+async def search_context(message, collection_name, embedding):
+    # Shielded: the embedding is shared with the answer cache, and this stage timing
+    # out must not cancel it.
+    embedding = await asyncio.shield(embedding)
+    if embedding is None:
+        return None
+    return await query(message, collection_name=collection_name, embedding=[embedding])
+
+
+async def prepare_chat_turn(item: Conversation):
+    """
+    Load the conversation window and build this turn's messages.
+
+    The conversation summary and recent messages, the farm's insights, the question
+    embedding and the document context (vector search on that embedding) are
+    fetched concurrently, each under its own timeout.
+    """
     conversation_id = item.conversation_id
     message = item.message
     collection_name = item.person_id
-    context = item.context
 
     logger.info("Received conversation_id: %s, message: %s", conversation_id, message)
 
@@ -62,70 +214,182 @@ async def get_openai_answer(item: Conversation):
             conversation_id = uuid.UUID(conversation_id)  # Ensure it's a valid UUID
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid conversation_id format. Expected a UUID.")
-
-        db_row = my_farmer_db.get_chat_conversation_by_id(id=conversation_id)
-
-        if db_row is None:
-            # If no conversation is found with the provided ID, create a new conversation.
-            conversation = [
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": message}
-            ]
-        else:
-            # Extract the conversation list from the returned dictionary.
-            conversation = db_row.get("conversation", [])
-            conversation.append({"role": "user", "content": message})
     else:
-        # No conversation_id provided; create a new conversation.
-        conversation = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": message}
-        ]
         conversation_id = None
 
+    # One embedding serves both the vector search and the answer cache, which are
+    # both per farmer; without a person_id nothing would use it.
+    embedding = None
     if collection_name:
-    # Add context and call OpenAI API.
-        try:
-            api_data = my_farmer_db.get_api_data_by_id(collection_name)
-
-            if api_data:
-                # Extract the conversation list from the returned dictionary.
-                conversation = db_row.get("conversation", [])
-                conversation.append({"role": "user", "content": message})
-                conversation.append({"role": "system", "content": f'Here are the insights: {api_data}'})
-            else:
-                conversation = db_row.get("conversation", [])
-                conversation.append({"role": "user", "content": message})
-        except Exception as e:
-            raise HTTPException(status_code=400, detail="Error fetching data from the database.")
+        embedding = asyncio.ensure_future(
+            optional_stage("embedding", embed_question(message), CHAT_CONTEXT_TIMEOUT))
+    stages = [load_window(conversation_id)]
+    if collection_name:
+        stages.append(optional_stage("insights", my_async_farmer_db.get_api_data_by_id(collection_name),
+                                     CHAT_INSIGHTS_TIMEOUT))
+        stages.append(optional_stage("context", search_context(message, collection_name, embedding),
+                                     CHAT_CONTEXT_TIMEOUT))
+    window, *optional = await asyncio.gather(*stages)
+    if embedding is not None:
+        # A failed or timed-out embedding is None already; a cancelled one is missing too.
+        embedding = None if embedding.cancelled() else await embedding
+    api_data, context = optional or (None, None)
+
+    context_messages = []
+    insights = insights_message(api_data)
+    if insights:
+        context_messages.append({"role": "system", "content": insights})
+    if context is not None:
+        context_messages.append({"role": "system", "content": truncate_to_tokens(
+            f'Use the following context: {context}', CHAT_CONTEXT_MAX_TOKENS)})
+
+    snapshot = fingerprint([api_data and api_data.get("api_data"),
+                            [point.payload for point in context or ()]])
+    return ChatTurn(conversation_id, window, {"role": "user", "content": message}, context_messages,
+                    context, collection_name, embedding, snapshot)
+
+
+# conversation_id -> running compaction task, so a conversation is compacted once at a time.
+_compactions = {}
+
+
+async def summarize_messages(summary, messages):
+    transcript = "\n".join(f'{message["role"]}: {message["content"]}' for message in messages)
+    conversation = [
+        {"role": "system", "content": CONVERSATION_SUMMARY_PROMPT.format(
+            max_words=CHAT_SUMMARY_MAX_TOKENS * 3 // 4)},
+        {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"},
+    ]
+    return truncate_to_tokens(await call_openai_api(conversation), CHAT_SUMMARY_MAX_TOKENS)
+
+
+async def compact_conversation(conversation_id):
+    """Fold the oldest messages after the summary into it while they are over budget."""
+    try:
+        window = await my_async_farmer_db.get_conversation_window(conversation_id)
+        if window is None:
+            return
+        history = [message for message in window["messages"] if message["role"] != "system"]
+        fold = messages_to_fold(history, CHAT_HISTORY_TOKENS, max_fold_tokens=CHAT_HISTORY_TOKENS)
+        if not fold:
+            return
+        summary = await summarize_messages(window["summary"], fold)
+        await my_async_farmer_db.update_conversation_summary(
+            conversation_id, summary, fold[-1]["seq"], window["summary_seq"])
+    except Exception as e:
+        logger.error("Error compacting conversation %s: %s", conversation_id, e)
+    finally:
+        _compactions.pop(conversation_id, None)
+
+
+async def store_turn(turn, answer):
+    """Append this turn's messages and compact the conversation in the background if it grew too long."""
+    turn.new_messages.append({"role": "assistant", "content": answer})
+    await my_async_farmer_db.append_messages(turn.conversation_id, turn.new_messages)
+    unsummarized = turn.history + [message for message in turn.new_messages if message["role"] != "system"]
+    if messages_tokens(unsummarized) > CHAT_HISTORY_TOKENS and turn.conversation_id not in _compactions:
+        _compactions[turn.conversation_id] = asyncio.create_task(compact_conversation(turn.conversation_id))
+
+
+# Partial turns being stored after their client disconnected; referenced until done.
+_detached_stores = set()
+
+
+async def store_partial_turn(turn, answer):
+    try:
+        await store_turn(turn, answer)
+    except Exception as e:
+        logger.error("Error storing partial answer for conversation %s: %s", turn.conversation_id, e)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream_chat_answer(turn, cached_answer=None):
+    """
+    Server-Sent Events for one chat turn: "start" with the conversation_id, a
+    "token" per piece of the answer as it is generated, then "done" once the
+    complete answer has been stored (or "error" if generating or storing it
+    failed). If the client disconnects mid-answer, the part generated so far is
+    stored in the background.
+    """
+    parts = []
+    finished = False
+    try:
+        yield sse_event("start", {"conversation_id": turn.conversation_id})
+        if cached_answer is not None:
+            parts.append(cached_answer)
+            yield sse_event("token", {"content": cached_answer})
+        else:
+            try:
+                async for token in stream_openai_api(turn.conversation):
+                    parts.append(token)
+                    yield sse_event("token", {"content": token})
+            except Exception:
+                finished = True
+                yield sse_event("error", {"detail": "Error generating the answer."})
+                return
+            if turn.cacheable:
+                answer_cache.set(turn.tenant, turn.embedding, turn.snapshot, "".join(parts))
+
+        finished = True
         try:
-            context = await query(message, collection_name=collection_name)
-            conversation.append({"role": "system", "content": f'Use the following context: {context}'})
+            await store_turn(turn, "".join(parts))
         except Exception as e:
-            raise HTTPException(status_code=400, detail="Error fetching data from the database.")    
-    else:
-        context = None
+            logger.error("Error storing chat turn for conversation %s: %s", turn.conversation_id, e)
+            yield sse_event("error", {"detail": "Error saving the conversation."})
+            return
+        yield sse_event("done", {"message": "Response generated successfully",
+                                 "conversation_id": turn.conversation_id, "context": turn.context})
+    finally:
+        if not finished and parts:
+            # The request is being torn down; store from a task that outlives it.
+            task = asyncio.create_task(store_partial_turn(turn, "".join(parts)))
+            _detached_stores.add(task)
+            task.add_done_callback(_detached_stores.discard)
 
-    openai_response = await call_openai_api(conversation)
-    conversation.append({"role": "assistant", "content": openai_response})
-    
-    # Update or insert the conversation into the DB.
-    if conversation_id:
-        my_farmer_db.update_chat_conversation(conversation_id, conversation)
+
+@app.post("/get_openai_answer")
+async def get_openai_answer(item: Conversation):
+    turn = await prepare_chat_turn(item)
+    # A new conversation is created on its first append.
+    if turn.conversation_id is None:
+        turn.conversation_id = uuid.uuid4()
+
+    cached_answer = None
+    if turn.cacheable:
+        cached_answer = answer_cache.get(turn.tenant, turn.embedding, turn.snapshot)
+
+    if item.stream:
+        return StreamingResponse(
+            stream_chat_answer(turn, cached_answer),
+            media_type="text/event-stream",
+            # Keep proxies from buffering the stream.
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    if cached_answer is not None:
+        openai_response = cached_answer
     else:
-        conversation_id = my_farmer_db.insert_chat_conversation(conversation)
+        openai_response = await call_openai_api(turn.conversation)
+        if turn.cacheable:
+            answer_cache.set(turn.tenant, turn.embedding, turn.snapshot, openai_response)
+
+    # Append this turn's messages.
+    await store_turn(turn, openai_response)
 
     return {
         "message": "Response generated successfully",
         "answer": openai_response,
-        "conversation_id": conversation_id,
-        'context': context
+        "conversation_id": turn.conversation_id,
+        'context': turn.context
     }
 
 
 @app.post("/get_user_info")
 async def get_user_info(person_id: str):
-    user_info = my_farmer_db.get_user_by_id(person_id)
+    user_info = await my_async_farmer_db.get_user_by_id(person_id)
     return {"user_info": user_info}
 
 
@@ -143,22 +407,30 @@ async def add_to_community(item: CommunityPost):
         f.write(image_data)
 
     # Insert the post into the database
-    my_farmer_db.insert_community(title, content, image_path, number_of_likes, number_of_comments)
+    await my_async_farmer_db.insert_community(title, content, image_path, number_of_likes, number_of_comments)
     return {"message": "Post added successfully"}
 
 @app.get("/get_community_posts")
-async def get_community_posts():
-    posts = my_farmer_db.get_all_community_posts()
-    return {"posts": posts}
+async def get_community_posts(limit: int = 50, cursor: Optional[str] = None):
+    """One page of posts, oldest first; pass next_cursor back as cursor for the next page."""
+    try:
+        posts, next_cursor = await my_async_farmer_db.get_community_posts_page(limit=limit, after=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"posts": posts, "next_cursor": next_cursor}
 
 @app.get('/get_insights')
 async def get_recommendations(id: str):
     # Optionally force an on-demand update:
     # fetch_all_data()
-    insights = my_farmer_db.get_api_data_by_id(id)
-    logger.info("Retrieved insights: %s", insights)
+    api_data = await my_async_farmer_db.get_api_data_by_id(id)
+    logger.info("Retrieved insights for %s", id)
     conversation = [{"role": "system", "content": "You are a helpful assistant."}]
-    conversation.append({"role": "system", "content": f'Here are the insights: {insights}'})
+    # The same bounded insights message as chat turns, without the daily series,
+    # benchmarks and fingerprints stored next to the insights.
+    message = insights_message(api_data)
+    if message:
+        conversation.append({"role": "system", "content": message})
 
     # TODO add json schema in this call
 
@@ -286,7 +558,7 @@ async def personalized_plan(
         
         
         # Insert the structured data into your database.
-        result = my_farmer_db.insert_users(
+        result = await my_async_farmer_db.insert_users(
             id=conversation_id,
             longitude=longitude,
             latitude=latitude,
@@ -309,11 +581,8 @@ async def personalized_plan(
             })
         )
 
-        # Start a background scheduler thread (if your scheduler needs updated coordinates).
-        scheduler_thread = threading.Thread(
-            target=start_scheduler, args=(conversation_id, longitude, latitude), daemon=True
-        )
-        scheduler_thread.start()
+        # The forecast scheduler, in whichever process runs it, picks the new farm up
+        # from the users change notification and refreshes it right away.
         
         # Once completed, remove the conversation state.
         del conversation_state[conversation_id]
@@ -321,6 +590,18 @@ async def personalized_plan(
         # Return the final structured result.
         return JSONResponse({"person_id": conversation_id, "data": parsed_response})
     
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        "forecast_cache": forecast_cache.stats(),
+        "api_data_writer": api_data_writer.stats(),
+        "conversation_archiver": conversation_archiver.stats(),
+        "answer_cache": answer_cache.stats(),
+        "database": my_farmer_db.pool_stats(),
+        "db_cache": my_farmer_db.cache_stats(),
+        "db_queries": my_farmer_db.query_stats(),
+    }
+
 @app.get("/session")
 async def get_session():
     url = "https://api.openai.com/v1/realtime/sessions"
@@ -0,0 +1,281 @@
+"""
+Versioned schema migrations for the farmer database.
+
+Each migration is (version, name, sql) and runs once, in its own transaction,
+in version order. Applied versions are recorded in public.schema_migrations.
+An advisory lock makes concurrent workers starting at the same time wait for
+each other instead of racing. Migrations are written to be safe on databases
+created before this module existed, when the tables were created with
+CREATE TABLE IF NOT EXISTS at every start.
+
+To change the schema, append a new migration; never edit one that has shipped.
+
+    python migrations.py          # apply pending migrations and list them
+"""
+
+# Arbitrary key for pg_advisory_lock, shared by every process migrating this database.
+MIGRATION_LOCK_KEY = 4206661
+
+
+MIGRATIONS = [
+    (1, "initial schema", '''
+        CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+        CREATE TABLE IF NOT EXISTS public.users (
+            id UUID PRIMARY KEY,
+            "createdAt" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            "name" TEXT,
+            "longitude" FLOAT,
+            "latitude" FLOAT,
+            "location" TEXT,
+            "crops" TEXT[],
+            "additional_info" JSONB
+        );
+
+        CREATE TABLE IF NOT EXISTS public.conversations (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            "createdAt" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            conversation JSONB
+        );
+
+        CREATE TABLE IF NOT EXISTS public.api_data (
+            id UUID PRIMARY KEY,
+            "createdAt" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            "api_data" JSONB
+        );
+
+        CREATE TABLE IF NOT EXISTS public.community (
+            id UUID PRIMARY KEY,
+            "createdAt" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            "title" TEXT,
+            "description" TEXT,
+            "image" TEXT,
+            "likes" INT,
+            "comments" JSONB
+        );
+    '''),
+
+    # Append-only daily forecast history. Each row stores one tile-day as
+    # parallel REAL arrays whose positions are described by a shared layout.
+    (2, "daily forecast history", '''
+        CREATE TABLE IF NOT EXISTS public.history_layouts (
+            layout TEXT PRIMARY KEY,
+            labels TEXT[] NOT NULL,
+            insights TEXT[] NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS public.daily_history (
+            tile TEXT NOT NULL,
+            day DATE NOT NULL,
+            "issuedAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            layout TEXT NOT NULL,
+            means REAL[] NOT NULL,
+            mins REAL[] NOT NULL,
+            maxs REAL[] NOT NULL,
+            sums REAL[] NOT NULL,
+            scores REAL[] NOT NULL,
+            PRIMARY KEY (tile, day, "issuedAt")
+        ) PARTITION BY RANGE (day);
+    '''),
+
+    # Raw endpoint results per tile, kept so insights can be replayed later.
+    (3, "forecast archive", '''
+        CREATE TABLE IF NOT EXISTS public.forecast_archive (
+            tile TEXT NOT NULL,
+            "fetchedAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            results JSONB NOT NULL,
+            PRIMARY KEY (tile, "fetchedAt")
+        );
+    '''),
+
+    # One row per chat message. last_seq on the conversation hands out
+    # sequence numbers, so a turn is a small insert instead of a rewrite.
+    (4, "chat messages", '''
+        ALTER TABLE public.conversations ADD COLUMN IF NOT EXISTS last_seq INT NOT NULL DEFAULT 0;
+
+        CREATE TABLE IF NOT EXISTS public.messages (
+            conversation_id UUID NOT NULL REFERENCES public.conversations (id) ON DELETE CASCADE,
+            seq INT NOT NULL,
+            "createdAt" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            role TEXT NOT NULL,
+            content TEXT,
+            PRIMARY KEY (conversation_id, seq)
+        );
+
+        -- Move conversations stored as a single JSONB array into messages.
+        WITH moved AS (
+            INSERT INTO public.messages (conversation_id, seq, role, content)
+            SELECT c.id, m.seq, COALESCE(m.message->>'role', 'user'), m.message->>'content'
+            FROM public.conversations c,
+                 jsonb_array_elements(c.conversation) WITH ORDINALITY AS m(message, seq)
+            WHERE c.last_seq = 0 AND jsonb_typeof(c.conversation) = 'array'
+            ON CONFLICT DO NOTHING
+            RETURNING conversation_id
+        )
+        UPDATE public.conversations c
+        SET last_seq = jsonb_array_length(c.conversation)
+        WHERE c.id IN (SELECT conversation_id FROM moved);
+    '''),
+
+    # Keyset pagination walks these in ("createdAt", id) order.
+    (5, "createdAt ordering indexes", '''
+        CREATE INDEX IF NOT EXISTS users_created_id_idx ON public.users ("createdAt", id);
+        CREATE INDEX IF NOT EXISTS community_created_id_idx ON public.community ("createdAt", id);
+        CREATE INDEX IF NOT EXISTS conversations_created_id_idx ON public.conversations ("createdAt", id);
+        CREATE INDEX IF NOT EXISTS api_data_created_id_idx ON public.api_data ("createdAt", id);
+    '''),
+
+    # Fleet queries: JSONB containment (@>), crops containment and coordinate boxes.
+    # jsonb_path_ops indexes are smaller and faster than the default opclass but
+    # only support @>, which is the only operator these columns are queried with.
+    (6, "fleet query indexes", '''
+        CREATE INDEX IF NOT EXISTS users_additional_info_gin_idx
+            ON public.users USING GIN (additional_info jsonb_path_ops);
+        CREATE INDEX IF NOT EXISTS api_data_api_data_gin_idx
+            ON public.api_data USING GIN (api_data jsonb_path_ops);
+        CREATE INDEX IF NOT EXISTS users_crops_gin_idx ON public.users USING GIN (crops);
+        CREATE INDEX IF NOT EXISTS users_coordinates_idx ON public.users (longitude, latitude);
+    '''),
+
+    # Typed copy of every farm's insights, one row per farm and insight, for
+    # threshold and top-K queries. api_data stays the source of truth.
+    (7, "insight scores", '''
+        CREATE TABLE IF NOT EXISTS public.insight_scores (
+            farm_id UUID NOT NULL,
+            insight TEXT NOT NULL,
+            score DOUBLE PRECISION,
+            interpretation TEXT,
+            "updatedAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (farm_id, insight)
+        );
+        CREATE INDEX IF NOT EXISTS insight_scores_score_idx
+            ON public.insight_scores (insight, score DESC NULLS LAST);
+        CREATE INDEX IF NOT EXISTS insight_scores_interpretation_idx
+            ON public.insight_scores (insight, interpretation);
+
+        -- Seed from the insight dicts already stored in api_data: objects holding a
+        -- numeric "... Score", an "Interpretation", or a single value under their own name.
+        INSERT INTO public.insight_scores (farm_id, insight, score, interpretation)
+        SELECT a.id, i.key,
+               (SELECT (v.value #>> '{}')::float8 FROM jsonb_each(i.value) v
+                WHERE v.key LIKE '% Score' AND jsonb_typeof(v.value) = 'number' LIMIT 1),
+               COALESCE(i.value ->> 'Interpretation', i.value ->> i.key)
+        FROM public.api_data a, jsonb_each(a.api_data) i
+        WHERE jsonb_typeof(a.api_data) = 'object'
+          AND jsonb_typeof(i.value) = 'object'
+          AND (i.value ? 'Interpretation' OR i.value ? i.key)
+        ON CONFLICT DO NOTHING;
+    '''),
+
+    # Cold storage for idle conversations: one compressed row per conversation
+    # replaces its conversations row and all of its messages rows.
+    (8, "conversation archive", '''
+        ALTER TABLE public.conversations
+            ADD COLUMN IF NOT EXISTS "lastMessageAt" TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+        UPDATE public.conversations c
+        SET "lastMessageAt" = COALESCE(
+            (SELECT max(m."createdAt") FROM public.messages m WHERE m.conversation_id = c.id),
+            c."createdAt", CURRENT_TIMESTAMP);
+        CREATE INDEX IF NOT EXISTS conversations_last_message_idx
+            ON public.conversations ("lastMessageAt");
+
+        -- Conversations moved into messages by migration 4 no longer need their JSONB copy.
+        UPDATE public.conversations SET conversation = NULL
+        WHERE conversation IS NOT NULL AND last_seq > 0;
+
+        CREATE TABLE IF NOT EXISTS public.conversation_archive (
+            conversation_id UUID PRIMARY KEY,
+            "createdAt" TIMESTAMP,
+            "lastMessageAt" TIMESTAMP,
+            "archivedAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_seq INT NOT NULL,
+            message_count INT NOT NULL,
+            codec TEXT NOT NULL,
+            payload BYTEA NOT NULL
+        );
+    '''),
+
+    # Running summary of the messages up to summary_seq, which chat turns send
+    # in place of those messages.
+    (9, "conversation summaries", '''
+        ALTER TABLE public.conversations ADD COLUMN IF NOT EXISTS summary TEXT;
+        ALTER TABLE public.conversations ADD COLUMN IF NOT EXISTS summary_seq INT NOT NULL DEFAULT 0;
+        ALTER TABLE public.conversation_archive ADD COLUMN IF NOT EXISTS summary TEXT;
+        ALTER TABLE public.conversation_archive ADD COLUMN IF NOT EXISTS summary_seq INT NOT NULL DEFAULT 0;
+    '''),
+
+    # Keyset pagination compares ("createdAt", id), which a NULL breaks. Legacy rows
+    # without a timestamp get the current one, keeping them last as NULLs sorted.
+    (10, "createdAt not null", '''
+        UPDATE public.users SET "createdAt" = CURRENT_TIMESTAMP WHERE "createdAt" IS NULL;
+        UPDATE public.community SET "createdAt" = CURRENT_TIMESTAMP WHERE "createdAt" IS NULL;
+        UPDATE public.conversations SET "createdAt" = CURRENT_TIMESTAMP WHERE "createdAt" IS NULL;
+        UPDATE public.api_data SET "createdAt" = CURRENT_TIMESTAMP WHERE "createdAt" IS NULL;
+        ALTER TABLE public.users ALTER COLUMN "createdAt" SET NOT NULL;
+        ALTER TABLE public.community ALTER COLUMN "createdAt" SET NOT NULL;
+        ALTER TABLE public.conversations ALTER COLUMN "createdAt" SET NOT NULL;
+        ALTER TABLE public.api_data ALTER COLUMN "createdAt" SET NOT NULL;
+
+        -- Restored conversations take their "createdAt" from the archive.
+        UPDATE public.conversation_archive SET "createdAt" = COALESCE("lastMessageAt", "archivedAt")
+        WHERE "createdAt" IS NULL;
+    '''),
+]
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM public.schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """
+    Apply every pending migration on conn and return the versions applied.
+
+    Leaves conn committed, with its autocommit setting unchanged.
+    """
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    applied = []
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            try:
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS public.schema_migrations (
+                        version INT PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        "appliedAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    );
+                ''')
+                conn.commit()
+                done = applied_versions(cursor)
+                for version, name, sql in sorted(migrations):
+                    if version in done:
+                        continue
+                    try:
+                        cursor.execute(sql)
+                        cursor.execute("INSERT INTO public.schema_migrations (version, name) VALUES (%s, %s)",
+                                       (version, name))
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        raise Exception(f"Migration {version} ({name}) failed: {e}") from e
+                    print(f"Applied migration {version}: {name}")
+                    applied.append(version)
+            finally:
+                conn.rollback()
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+                conn.commit()
+    finally:
+        conn.autocommit = autocommit
+    return applied
+
+
+if __name__ == "__main__":
+    from models import my_farmer_db
+
+    with my_farmer_db.transaction() as conn, conn.cursor() as cursor:
+        cursor.execute('SELECT version, name, "appliedAt" FROM public.schema_migrations ORDER BY version')
+        for version, name, applied_at in cursor.fetchall():
+            print(f"{version:>4}  {applied_at:%Y-%m-%d %H:%M}  {name}")
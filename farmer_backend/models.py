@@ -1,272 +1,844 @@
+import asyncio
+import functools
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
+import psycopg2.sql
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from migrations import migrate
+from tools.ttl_cache import TTLCache
+from tools.compression import compress_json, decompress_json
+from db_metrics import InstrumentedConnection, instrument_methods, query_metrics
 import os
+import random
+import select
+import threading
+import uuid
 import time 
+import datetime
+import base64
+import json
 
 load_dotenv()
 
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+# How long a caller waits for a free connection before giving up.
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", 30))
+DB_CONNECT_ATTEMPTS = int(os.getenv("DB_CONNECT_ATTEMPTS", 8))
+DB_CONNECT_BACKOFF = float(os.getenv("DB_CONNECT_BACKOFF_SECONDS", 0.5))
+DB_CONNECT_BACKOFF_MAX = float(os.getenv("DB_CONNECT_BACKOFF_MAX_SECONDS", 15))
+# Connections idle for longer than this are pinged before being handed out.
+DB_HEALTH_CHECK_SECONDS = float(os.getenv("DB_HEALTH_CHECK_SECONDS", 30))
+# Rows fetched per round trip by server-side (streaming) cursors.
+DB_STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", 1000))
+PAGE_SIZE_MAX = 500
+# Read-through cache for single-row reads of users and api_data (see farmer_db._read_through).
+DB_CACHE_ENABLED = os.getenv("DB_CACHE_ENABLED", "true").lower() == "true"
+DB_CACHE_MAXSIZE = int(os.getenv("DB_CACHE_MAXSIZE", 10000))
+DB_CACHE_TTL = float(os.getenv("DB_CACHE_TTL_SECONDS", 300))
+# NOTIFY channel on which writers publish "<table>:<id>" for every row they change.
+CACHE_INVALIDATION_CHANNEL = "farmer_db_invalidate"
+# Conversations without a new message for this many days move to conversation_archive.
+CONVERSATION_ARCHIVE_IDLE_DAYS = float(os.getenv("CONVERSATION_ARCHIVE_IDLE_DAYS", 30))
+CONVERSATION_ARCHIVE_BATCH_SIZE = int(os.getenv("CONVERSATION_ARCHIVE_BATCH_SIZE", 200))
+
+_MISSING = object()
+
+# Columns that list queries may project, per table.
+TABLE_COLUMNS = {
+    "users": ("id", "createdAt", "name", "longitude", "latitude", "location", "crops", "additional_info"),
+    "community": ("id", "createdAt", "title", "description", "image", "likes", "comments"),
+    "conversations": ("id", "createdAt", "last_seq", "lastMessageAt", "summary", "summary_seq"),
+    "api_data": ("id", "createdAt", "api_data"),
+}
+# Tables that support bulk COPY import/export, with the columns an import overwrites.
+COPY_UPSERT_COLUMNS = {
+    "users": ("name", "longitude", "latitude", "location", "crops", "additional_info"),
+    "api_data": ("api_data",),
+}
+COPY_FORMATS = ("csv", "binary")
+# Rebuild the insight_scores rows of the api_data records in %(ids)s, limited to the
+# insights in %(insights)s unless it is NULL. Rows are derived from the stored JSON the
+# same way migration 7 seeded the table, so every api_data write keeps it in step.
+INSIGHT_SCORES_REFRESH = '''
+    DELETE FROM public.insight_scores
+    WHERE farm_id = ANY(%(ids)s::uuid[])
+      AND (%(insights)s::text[] IS NULL OR insight = ANY(%(insights)s::text[]));
+    INSERT INTO public.insight_scores (farm_id, insight, score, interpretation)
+    SELECT a.id, i.key,
+           (SELECT (v.value #>> '{}')::float8 FROM jsonb_each(i.value) v
+            WHERE v.key LIKE '%% Score' AND jsonb_typeof(v.value) = 'number' LIMIT 1),
+           COALESCE(i.value ->> 'Interpretation', i.value ->> i.key)
+    FROM public.api_data a, jsonb_each(a.api_data) i
+    WHERE a.id = ANY(%(ids)s::uuid[])
+      AND (%(insights)s::text[] IS NULL OR i.key = ANY(%(insights)s::text[]))
+      AND jsonb_typeof(a.api_data) = 'object'
+      AND jsonb_typeof(i.value) = 'object'
+      AND (i.value ? 'Interpretation' OR i.value ? i.key)
+'''
+
+
+def encode_page_cursor(created_at, id):
+    """Opaque token for the keyset position ("createdAt", id) of the last row of a page."""
+    raw = json.dumps([created_at.isoformat(), str(id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_page_cursor(token):
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.datetime.fromisoformat(created_at), id
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid page cursor: {token!r}") from e
+
+
+@instrument_methods
 class farmer_db:
-    def __init__(self, conn_params):
-        attempts = 5
-        while attempts:
+    """
+    Data access for the farmer backend on top of a thread-safe connection pool.
+
+    Nothing connects at construction: the pool is opened, and pending migrations are
+    applied, on first use, retrying with exponential backoff while Postgres starts. Every
+    method checks out its own connection and runs in its own transaction, so callers
+    on different threads never share or roll back each other's work.
+    """
+
+    # Bookkeeping methods that run no queries of their own (see db_metrics).
+    uninstrumented = ("transaction", "pool_stats", "cache_stats", "query_stats", "subscribe", "close")
+
+    def __init__(self, conn_params, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX):
+        self.conn_params = conn_params
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = None
+        self._pool_lock = threading.RLock()
+        # ThreadedConnectionPool raises when exhausted; the semaphore makes callers wait instead.
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._in_use = 0
+        self._stats_lock = threading.Lock()
+        self._history_partitions = set()
+        self._caches = {}
+        if DB_CACHE_ENABLED:
+            self._caches = {table: TTLCache(DB_CACHE_MAXSIZE, DB_CACHE_TTL) for table in ("users", "api_data")}
+        # Bumped on every invalidation; a read that raced one does not populate the cache.
+        self._cache_generation = 0
+        # Cache entries to drop once the transaction running on a connection commits.
+        self._pending_invalidations = {}
+        self._listener = None
+        self._listener_stop = threading.Event()
+        self._listener_connected = False
+        self._subscribers = []
+
+    def _get_pool(self):
+        if self._pool is not None:
+            return self._pool
+        with self._pool_lock:
+            if self._pool is None:
+                pool = self._connect_pool()
+                conn = pool.getconn()
+                try:
+                    migrate(conn)
+                except Exception:
+                    pool.closeall()
+                    raise
+                pool.putconn(conn)
+                # Publish the pool only once the schema is up to date.
+                self._pool = pool
+                if self._caches or self._subscribers:
+                    self._start_listener()
+        return self._pool
+
+    def _connect_pool(self):
+        for attempt in range(DB_CONNECT_ATTEMPTS):
             try:
-                self.conn = psycopg2.connect(**conn_params)
-                break
+                return psycopg2.pool.ThreadedConnectionPool(self.minconn, self.maxconn, **self.conn_params)
             except psycopg2.OperationalError as e:
-                attempts -= 1
-                print("Postgres not ready, retrying in 10 seconds...")
-                time.sleep(10)
+                if attempt == DB_CONNECT_ATTEMPTS - 1:
+                    break
+                delay = random.uniform(0, min(DB_CONNECT_BACKOFF_MAX, DB_CONNECT_BACKOFF * 2 ** attempt))
+                print(f"Postgres not ready ({str(e).strip().splitlines()[0]}), retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+        raise Exception("Could not connect to Postgres after multiple attempts")
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0) < DB_HEALTH_CHECK_SECONDS:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        pool = self._get_pool()
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise psycopg2.pool.PoolError("Timed out waiting for a database connection")
+        try:
+            conn = pool.getconn()
+            while not self._healthy(conn):
+                self._last_used.pop(id(conn), None)
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._stats_lock:
+            self._in_use += 1
+        return conn
+
+    def _release(self, conn, broken=False):
+        broken = broken or conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        if broken:
+            self._last_used.pop(id(conn), None)
         else:
-            raise Exception("Could not connect to Postgres after multiple attempts")
-        self._create_tables()
-    
-    def _create_tables(self):
-        with self.conn.cursor() as cursor:
-            self.conn.autocommit = True
+            self._last_used[id(conn)] = time.monotonic()
+        try:
+            self._pool.putconn(conn, close=broken)
+        finally:
+            with self._stats_lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Check out a pooled connection for one transaction: commit when the block
+        succeeds, roll back when it raises, and always return the connection.
+        """
+        conn = self._checkout()
+        broken = False
+        try:
+            yield InstrumentedConnection(conn)
+            conn.commit()
+            # Only now can a reader no longer load the old rows back into the cache.
+            for table, ids in self._pending_invalidations.pop(conn, ()):
+                if ids is None:
+                    self._invalidate_all(table)
+                else:
+                    self._invalidate(table, ids)
+        except Exception:
             try:
-                cursor.execute('''
-                    DO $$ 
-                    BEGIN 
-                        IF NOT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pgcrypto') THEN
-                            CREATE EXTENSION pgcrypto;
-                        END IF;
-                    END $$;
-                ''')
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS public.users (
-                        id UUID PRIMARY KEY,
-                        "createdAt" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        "name" TEXT,
-                        "longitude" FLOAT,
-                        "latitude" FLOAT,
-                        "location" TEXT,
-                        "crops" TEXT[],
-                        "additional_info" JSONB
-                    );
-                ''')
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS public.conversations (
-                        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                        "createdAt" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        conversation JSONB
-                    );
-                ''')
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            self._pending_invalidations.pop(conn, None)
+            self._release(conn, broken)
 
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS public.api_data (
-                        id UUID PRIMARY KEY,
-                        "createdAt" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        "api_data" JSONB
-                    );
-                ''')
+    def pool_stats(self):
+        return {
+            "connected": self._pool is not None,
+            "min": self.minconn,
+            "max": self.maxconn,
+            "in_use": self._in_use,
+        }
 
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS public.community (
-                        id UUID PRIMARY KEY,
-                        "createdAt" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        "title" TEXT,
-                        "description" TEXT,
-                        "image" TEXT,
-                        "likes" INT,
-                        "comments" JSONB
-                    );
-                ''')
+    def query_stats(self):
+        return query_metrics.snapshot()
+
+    def cache_stats(self):
+        stats = {table: cache.stats() for table, cache in self._caches.items()}
+        stats["listener_connected"] = self._listener_connected
+        return stats
+
+    def _read_through(self, table, id, load):
+        cache = self._caches.get(table)
+        if cache is None:
+            return load(id)
+        key = str(id)
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        generation = self._cache_generation
+        value = load(id)
+        if generation == self._cache_generation:
+            cache.set(key, value)
+        return value
+
+    def _invalidate(self, table, ids):
+        cache = self._caches.get(table)
+        if cache is None:
+            return
+        self._cache_generation += 1
+        for id in ids:
+            cache.delete(str(id))
+
+    def _invalidate_all(self, table):
+        cache = self._caches.get(table)
+        if cache is not None:
+            self._cache_generation += 1
+            cache.clear()
+
+    def _notify(self, cursor, table, ids):
+        """
+        Publish invalidations for rows changed in the current transaction. Postgres
+        delivers them on commit to every listening worker; this one drops its own
+        copies as soon as transaction() has committed.
+        """
+        ids = [str(id) for id in ids]
+        cursor.execute(
+            "SELECT pg_notify(%s, %s || ':' || id) FROM unnest(%s::text[]) AS id",
+            (CACHE_INVALIDATION_CHANNEL, table, ids)
+        )
+        self._pending_invalidations.setdefault(cursor.connection, []).append((table, ids))
+
+    def _notify_all(self, cursor, table):
+        """Like _notify, for changes too large to name row by row (bulk imports)."""
+        cursor.execute("SELECT pg_notify(%s, %s)", (CACHE_INVALIDATION_CHANNEL, f"{table}:*"))
+        self._pending_invalidations.setdefault(cursor.connection, []).append((table, None))
+
+    def subscribe(self, callback):
+        """
+        Call callback(table, id) on the listener thread for every row change any
+        worker publishes (see _notify). id is "*" for bulk changes, and table and id
+        are both "*" after the listener reconnects, since changes may have been missed.
+        """
+        self._subscribers.append(callback)
+        with self._pool_lock:
+            if self._pool is not None and self._listener is None:
+                self._start_listener()
 
+    def _publish(self, table, id):
+        for callback in self._subscribers:
+            try:
+                callback(table, id)
             except Exception as e:
-                print("Error creating tables:", e)
+                print(f"Change subscriber failed: {e}")
+
+    def _start_listener(self):
+        self._listener_stop.clear()
+        self._listener = threading.Thread(target=self._listen, name="farmer_db_listener", daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        """Drop cache entries named by invalidation notifications, and pass them on to subscribers, until close()."""
+        attempt = 0
+        reconnecting = False
+        while not self._listener_stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.conn_params)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CACHE_INVALIDATION_CHANNEL}")
+                # Anything may have changed while no one was listening.
+                for cache in self._caches.values():
+                    cache.clear()
+                if reconnecting:
+                    self._publish("*", "*")
+                reconnecting = True
+                self._listener_connected = True
+                attempt = 0
+                while not self._listener_stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        table, _, id = conn.notifies.pop(0).payload.partition(":")
+                        if id == "*":
+                            self._invalidate_all(table)
+                        else:
+                            self._invalidate(table, [id])
+                        self._publish(table, id)
+            except psycopg2.Error as e:
+                self._listener_connected = False
+                delay = min(DB_CONNECT_BACKOFF_MAX, DB_CONNECT_BACKOFF * 2 ** attempt)
+                attempt += 1
+                print(f"Cache invalidation listener disconnected ({str(e).strip().splitlines()[0]}), "
+                      f"reconnecting in {delay:.1f} seconds...")
+                self._listener_stop.wait(delay)
             finally:
-                self.conn.autocommit = False
+                if conn is not None:
+                    conn.close()
+        self._listener_connected = False
 
+    def close(self):
+        if self._listener is not None:
+            self._listener_stop.set()
+            self._listener.join(timeout=5)
+            self._listener = None
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+
+    def _columns(self, table, columns):
+        columns = TABLE_COLUMNS[table] if columns is None else tuple(columns)
+        unknown = set(columns) - set(TABLE_COLUMNS[table])
+        if unknown:
+            raise ValueError(f"Unknown columns for {table}: {sorted(unknown)}")
+        return psycopg2.sql.SQL(", ").join(psycopg2.sql.Identifier(column) for column in columns)
+
+    def _page(self, table, columns=None, limit=100, after=None):
+        """
+        One keyset page of a table ordered by ("createdAt", id).
+
+        after is the cursor returned with the previous page. Returns (rows, next cursor);
+        the cursor is None on the last page. The cost of a page does not depend on how
+        deep into the table it is, unlike OFFSET.
+        """
+        limit = max(1, min(int(limit), PAGE_SIZE_MAX))
+        where = psycopg2.sql.SQL("")
+        params = []
+        if after is not None:
+            where = psycopg2.sql.SQL('WHERE ("createdAt", id) > (%s, %s)')
+            params += list(decode_page_cursor(after))
+        query = psycopg2.sql.SQL('''
+            SELECT {columns}, "createdAt" AS _page_created, id AS _page_id FROM {table}
+            {where}
+            ORDER BY "createdAt", id
+            LIMIT %s
+        ''').format(columns=self._columns(table, columns), table=psycopg2.sql.Identifier("public", table), where=where)
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                # One extra row tells whether there is a next page.
+                cursor.execute(query, params + [limit + 1])
+                rows = cursor.fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_page_cursor(rows[-1]["_page_created"], rows[-1]["_page_id"])
+        for row in rows:
+            del row["_page_created"], row["_page_id"]
+        return [dict(row) for row in rows], next_cursor
+
+    def _stream(self, table, columns=None, batch_size=DB_STREAM_BATCH_SIZE):
+        """
+        Yield every row of a table as a dict through a named server-side cursor, so
+        only batch_size rows are held in memory at a time. The pooled connection is
+        held until the generator is exhausted or closed.
+        """
+        query = psycopg2.sql.SQL("SELECT {columns} FROM {table}").format(
+            columns=self._columns(table, columns), table=psycopg2.sql.Identifier("public", table))
+        with self.transaction() as conn:
+            with conn.cursor(name=f"stream_{table}_{uuid.uuid4().hex}",
+                             cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(query)
+                for row in cursor:
+                    yield dict(row)
 
     def get_users(self):
-        try:
-            with self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
                 cursor.execute("SELECT * FROM public.users")
                 rows = cursor.fetchall()
                 return [dict(row) for row in rows]
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+
+    def get_users_page(self, columns=None, limit=100, after=None):
+        return self._page("users", columns, limit, after)
+
+    def iter_users(self, columns=None, batch_size=DB_STREAM_BATCH_SIZE):
+        return self._stream("users", columns, batch_size)
+
+    def find_farms(self, crop=None, near=None, radius_degrees=0.5, additional_info=None,
+                   columns=("id", "longitude", "latitude", "location", "crops"), limit=100):
+        """
+        Fleet query, e.g. all farms growing crop within radius_degrees of near=(longitude, latitude)
+        whose additional_info contains the given keys and values. Every filter is
+        served by an index (crops GIN, coordinates btree, additional_info GIN).
+        Results are ordered by distance when near is given.
+        """
+        conditions = []
+        params = []
+        if crop is not None:
+            conditions.append(psycopg2.sql.SQL("crops @> ARRAY[%s]::text[]"))
+            params.append(crop)
+        if near is not None:
+            longitude, latitude = near
+            conditions.append(psycopg2.sql.SQL("longitude BETWEEN %s AND %s AND latitude BETWEEN %s AND %s"))
+            params += [longitude - radius_degrees, longitude + radius_degrees,
+                       latitude - radius_degrees, latitude + radius_degrees]
+        if additional_info:
+            conditions.append(psycopg2.sql.SQL("additional_info @> %s"))
+            params.append(psycopg2.extras.Json(additional_info))
+        where = psycopg2.sql.SQL("WHERE ") + psycopg2.sql.SQL(" AND ").join(conditions) if conditions else psycopg2.sql.SQL("")
+        order = psycopg2.sql.SQL("ORDER BY id")
+        if near is not None:
+            order = psycopg2.sql.SQL("ORDER BY (longitude - %s) ^ 2 + (latitude - %s) ^ 2")
+            params += [near[0], near[1]]
+        query = psycopg2.sql.SQL("SELECT {columns} FROM public.users {where} {order} LIMIT %s").format(
+            columns=self._columns("users", columns), where=where, order=order)
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                cursor.execute(query, params + [limit])
+                return [dict(row) for row in cursor.fetchall()]
 
     def insert_users(self, id ,longitude, latitude, location, crops, additional_info):
-        try:
-            with self.conn.cursor() as cursor:
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
                 cursor.execute('''
                     INSERT INTO public.users (id, longitude, latitude, location, crops, additional_info)
                     VALUES (%s, %s, %s, %s, %s, %s)
                     RETURNING id;
                 ''', (id, longitude, latitude, location, crops, additional_info))
                 new_id = cursor.fetchone()[0]
-            self.conn.commit()
+                self._notify(cursor, "users", [new_id])
             return new_id
-        except Exception as e:
-            self.conn.rollback()
-            raise e
 
 
+    def upsert_users_many(self, users):
+        """
+        Insert or update many users (dicts with the insert_users fields) in one statement.
+        """
+        if not users:
+            return 0
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                psycopg2.extras.execute_values(cursor, '''
+                    INSERT INTO public.users (id, longitude, latitude, location, crops, additional_info)
+                    VALUES %s
+                    ON CONFLICT (id) DO UPDATE
+                    SET longitude = EXCLUDED.longitude, latitude = EXCLUDED.latitude,
+                        location = EXCLUDED.location, crops = EXCLUDED.crops,
+                        additional_info = EXCLUDED.additional_info
+                ''', [(user["id"], user.get("longitude"), user.get("latitude"), user.get("location"),
+                       user.get("crops"), user.get("additional_info")) for user in users], page_size=500)
+                self._notify(cursor, "users", [user["id"] for user in users])
+            return len(users)
+
     def update_users(self, id, longitude, latitude, location, crops, additional_info):
-        try:
-            with self.conn.cursor() as cursor:
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
                 cursor.execute('''
                     UPDATE public.users
                     SET longitude = %s, latitude = %s, location = %s, crops = %s, additional_info = %s
                     WHERE id = %s
                 ''', (longitude, latitude, location, crops, additional_info, id))
-            self.conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+                updated = cursor.rowcount > 0
+                self._notify(cursor, "users", [id])
+            return updated
 
     def delete_users(self, id):
-        try:
-            with self.conn.cursor() as cursor:
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
                 cursor.execute('''
                     DELETE FROM public.users WHERE id = %s
                 ''', (id,))
-            self.conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+                deleted = cursor.rowcount > 0
+                # A farm's id is its user's id; drop its rows from the fleet insight queries.
+                cursor.execute("DELETE FROM public.insight_scores WHERE farm_id = %s", (id,))
+                self._notify(cursor, "users", [id])
+            return deleted
 
     def get_user_by_id(self, id):
-        try:
-            with self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        """
+        Cached: the returned dict is shared between callers and must not be modified.
+        """
+        return self._read_through("users", id, self._select_user_by_id)
+
+    def _select_user_by_id(self, id):
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
                 cursor.execute("SELECT * FROM public.users WHERE id = %s", (id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
-        except Exception as e:
-            self.conn.rollback()
-            raise e
 
-    def insert_chat_conversation(self ,conversation):
-        try:
-            with self.conn.cursor() as cursor:
+    def append_messages(self, conversation_id, messages):
+        """
+        Append messages ({"role", "content"} dicts) to a conversation, creating the
+        conversation if it does not exist. Returns the seq of the last message.
+        """
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                # The row lock taken here serialises concurrent appends to one conversation,
+                # and waits for the archiver if it is moving this conversation right now.
+                # xmax = 0 only for a freshly inserted row.
                 cursor.execute('''
-                    INSERT INTO public.conversations (conversation)
-                    VALUES (%s)
-                    RETURNING id;
-                ''', (psycopg2.extras.Json(conversation),))
-                new_id = cursor.fetchone()[0]
-            self.conn.commit()
-            return new_id
-        except Exception as e:
-            self.conn.rollback()
-            raise e
-        
+                    INSERT INTO public.conversations (id, last_seq)
+                    VALUES (%s, %s)
+                    ON CONFLICT (id) DO UPDATE
+                    SET last_seq = public.conversations.last_seq + EXCLUDED.last_seq,
+                        "lastMessageAt" = CURRENT_TIMESTAMP
+                    RETURNING last_seq, xmax = 0;
+                ''', (str(conversation_id), len(messages)))
+                last_seq, inserted = cursor.fetchone()
+                if inserted:
+                    # A conversation that is new to the hot tables may be an archived one.
+                    last_seq = self._unarchive_conversation(cursor, conversation_id, last_seq)
+                first_seq = last_seq - len(messages) + 1
+                psycopg2.extras.execute_values(cursor, '''
+                    INSERT INTO public.messages (conversation_id, seq, role, content)
+                    VALUES %s
+                ''', [(str(conversation_id), first_seq + i, message["role"], message.get("content"))
+                      for i, message in enumerate(messages)])
+            return last_seq
+
+    def get_recent_messages(self, conversation_id, limit=None):
+        """
+        Retrieve the latest `limit` messages of a conversation (all when limit is None),
+        oldest first, as {"role", "content"} dicts. Archived conversations are read
+        from conversation_archive.
+        """
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    SELECT role, content FROM public.messages
+                    WHERE conversation_id = %s
+                    ORDER BY seq DESC
+                    LIMIT %s
+                ''', (str(conversation_id), limit))
+                rows = cursor.fetchall()
+                if not rows:
+                    archived = self._select_archived_conversation(cursor, conversation_id)
+                    if archived is not None:
+                        messages = archived["messages"][-limit:] if limit else archived["messages"]
+                        return [{"role": message["role"], "content": message["content"]} for message in messages]
+            return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def get_conversation_window(self, conversation_id, limit=None):
+        """
+        Retrieve what a chat turn is built from: the conversation's running summary,
+        the seq it covers up to, and the latest `limit` messages after that seq
+        (all when limit is None), oldest first, as {"seq", "role", "content"} dicts.
+        Returns None for an unknown conversation.
+        """
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT summary, summary_seq FROM public.conversations WHERE id = %s",
+                               (str(conversation_id),))
+                row = cursor.fetchone()
+                if row is None:
+                    archived = self._select_archived_conversation(cursor, conversation_id)
+                    if archived is None:
+                        return None
+                    messages = [{"seq": message["seq"], "role": message["role"], "content": message["content"]}
+                                for message in archived["messages"] if message["seq"] > archived["summary_seq"]]
+                    return {"summary": archived["summary"], "summary_seq": archived["summary_seq"],
+                            "messages": messages[-limit:] if limit else messages}
+                summary, summary_seq = row
+                cursor.execute('''
+                    SELECT seq, role, content FROM public.messages
+                    WHERE conversation_id = %s AND seq > %s
+                    ORDER BY seq DESC
+                    LIMIT %s
+                ''', (str(conversation_id), summary_seq, limit))
+                rows = cursor.fetchall()
+            return {"summary": summary, "summary_seq": summary_seq,
+                    "messages": [{"seq": seq, "role": role, "content": content}
+                                 for seq, role, content in reversed(rows)]}
+
+    def update_conversation_summary(self, conversation_id, summary, summary_seq, previous_seq):
+        """
+        Store a new running summary covering the messages up to summary_seq. Only
+        applies if the stored summary still ends at previous_seq, so concurrent
+        compactions cannot overwrite each other. Returns whether it was stored.
+        """
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    UPDATE public.conversations SET summary = %s, summary_seq = %s
+                    WHERE id = %s AND summary_seq = %s
+                ''', (summary, summary_seq, str(conversation_id), previous_seq))
+            return cursor.rowcount > 0
+
+    def _select_archived_conversation(self, cursor, conversation_id):
+        """Read an archived conversation in place, without moving it back to the hot tables."""
+        cursor.execute('''
+            SELECT "createdAt", "lastMessageAt", "archivedAt", last_seq, summary, summary_seq, codec, payload
+            FROM public.conversation_archive WHERE conversation_id = %s
+        ''', (str(conversation_id),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        created_at, last_message_at, archived_at, last_seq, summary, summary_seq, codec, payload = row
+        return {
+            "id": str(conversation_id),
+            "createdAt": created_at,
+            "last_seq": last_seq,
+            "lastMessageAt": last_message_at,
+            "archivedAt": archived_at,
+            "summary": summary,
+            "summary_seq": summary_seq,
+            # {"seq", "createdAt", "role", "content"} dicts, as written by archive_idle_conversations.
+            "messages": decompress_json(codec, payload),
+        }
+
+    def _unarchive_conversation(self, cursor, conversation_id, last_seq):
+        """
+        Move an archived conversation back into conversations and messages, ahead of
+        the messages being appended. Takes the last_seq just handed out for the
+        appended messages and returns it shifted past the restored ones.
+        """
+        cursor.execute('''
+            DELETE FROM public.conversation_archive WHERE conversation_id = %s
+            RETURNING "createdAt", last_seq, summary, summary_seq, codec, payload
+        ''', (str(conversation_id),))
+        row = cursor.fetchone()
+        if row is None:
+            return last_seq
+        created_at, archived_seq, summary, summary_seq, codec, payload = row
+        messages = decompress_json(codec, payload)
+        if messages:
+            psycopg2.extras.execute_values(cursor, '''
+                INSERT INTO public.messages (conversation_id, seq, "createdAt", role, content)
+                VALUES %s
+            ''', [(str(conversation_id), message["seq"], message["createdAt"], message["role"], message["content"])
+                  for message in messages])
+        cursor.execute('''
+            UPDATE public.conversations
+            SET last_seq = last_seq + %s, "createdAt" = COALESCE(%s, "createdAt"), summary = %s, summary_seq = %s
+            WHERE id = %s RETURNING last_seq
+        ''', (archived_seq, created_at, summary, summary_seq, str(conversation_id)))
+        return cursor.fetchone()[0]
+
+    def archive_idle_conversations(self, idle_days=CONVERSATION_ARCHIVE_IDLE_DAYS,
+                                   batch_size=CONVERSATION_ARCHIVE_BATCH_SIZE):
+        """
+        Move up to batch_size conversations without a message in idle_days days to
+        conversation_archive, each as one compressed row, and delete their hot rows
+        and messages. Returns the number archived; call again until it returns 0.
+
+        Reads keep working on archived conversations (see get_recent_messages), and
+        appending to one moves it back. Conversations locked by a concurrent append
+        are skipped, so several workers can run this at once.
+        """
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    SELECT id, "createdAt", "lastMessageAt", last_seq, summary, summary_seq
+                    FROM public.conversations
+                    WHERE "lastMessageAt" < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    ORDER BY "lastMessageAt"
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ''', (idle_days * 86400, batch_size))
+                conversations = cursor.fetchall()
+                if not conversations:
+                    return 0
+                ids = [str(row[0]) for row in conversations]
+                cursor.execute('''
+                    SELECT conversation_id, seq, "createdAt", role, content FROM public.messages
+                    WHERE conversation_id = ANY(%s::uuid[])
+                    ORDER BY conversation_id, seq
+                ''', (ids,))
+                messages = {id: [] for id in ids}
+                for conversation_id, seq, created_at, role, content in cursor.fetchall():
+                    messages[str(conversation_id)].append(
+                        {"seq": seq, "createdAt": created_at, "role": role, "content": content})
+                rows = []
+                for id, created_at, last_message_at, last_seq, summary, summary_seq in conversations:
+                    batch = messages[str(id)]
+                    codec, payload = compress_json(batch)
+                    rows.append((str(id), created_at, last_message_at, last_seq, summary, summary_seq,
+                                 len(batch), codec, psycopg2.Binary(payload)))
+                psycopg2.extras.execute_values(cursor, '''
+                    INSERT INTO public.conversation_archive
+                        (conversation_id, "createdAt", "lastMessageAt", last_seq, summary, summary_seq,
+                         message_count, codec, payload)
+                    VALUES %s
+                ''', rows)
+                # Messages go with their conversation (ON DELETE CASCADE).
+                cursor.execute("DELETE FROM public.conversations WHERE id = ANY(%s::uuid[])", (ids,))
+            return len(ids)
+
     def insert_community(self, id, title, description, image, likes, comments):
-        try:
-            with self.conn.cursor() as cursor:
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
                 cursor.execute('''
                     INSERT INTO public.community (id, title, description, image, likes, comments)
                     VALUES (%s, %s, %s, %s, %s< %s) 
                     RETURNING id;
                 ''', (id, title, description, image, likes, psycopg2.extras.Json(comments)))
                 new_id = cursor.fetchone()[0]
-            self.conn.commit()
             return new_id
-        except Exception as e:
-            self.conn.rollback()
-            raise e
     
     def get_community_by_id(self, id):
-        try:
-            with self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
                 cursor.execute("SELECT * FROM public.community WHERE id = %s", (id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
-        except Exception as e:
-            self.conn.rollback()
-            raise e
 
     def update_community(self, id, title, description, image, likes, comments):
-        try:
-            with self.conn.cursor() as cursor:
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
                 cursor.execute('''
                     UPDATE public.community
                     SET title = %s, description = %s, image = %s, likes = %s, comments = %s
                     WHERE id = %s
                 ''', (title, description, image, likes, psycopg2.extras.Json(comments), id))
-            self.conn.commit()
-        except Exception as e:
-            self.conn.rollback()
-            raise e
 
     def delete_community_by_id(self, id):
-        try:
-            with self.conn.cursor() as cursor:
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
                 cursor.execute("DELETE FROM public.community WHERE id = %s", (id,))
-            self.conn.commit()
             return cursor.rowcount > 0
-        except Exception as e:
-            self.conn.rollback()
-            raise e
     
     def get_all_community_posts(self):
-        try:
-            with self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
                 cursor.execute("SELECT * FROM public.community")
                 rows = cursor.fetchall()
                 return [dict(row) for row in rows]
-        except Exception as e:
-            self.conn.rollback()
-            raise e
         
+    def get_community_posts_page(self, columns=None, limit=100, after=None):
+        return self._page("community", columns, limit, after)
+
     def get_all_chat_conversations(self):
-        try:
-            with self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
                 cursor.execute("SELECT * FROM public.conversations")
                 rows = cursor.fetchall()
                 return [dict(row) for row in rows]  # Convert to JSON format
-        except Exception as e:
-            self.conn.rollback()
-            raise e
-            
-    def update_chat_conversation(self, id, conversation):
-        try:
-            with self.conn.cursor() as cursor:
-                cursor.execute('''
-                    UPDATE public.conversations
-                    SET conversation = %s
-                    WHERE id = %s
-                ''', (psycopg2.extras.Json(conversation), id))
-            self.conn.commit()
-        except Exception as e:
-            self.conn.rollback()
-            raise e
             
+    def get_chat_conversations_page(self, columns=None, limit=100, after=None):
+        return self._page("conversations", columns, limit, after)
+
     def get_chat_conversation_by_id(self, id):
-        try:
-            with self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-                cursor.execute("SELECT * FROM public.conversations WHERE id = %s", (str(id),))
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute("SELECT id, \"createdAt\", last_seq FROM public.conversations WHERE id = %s", (str(id),))
                 row = cursor.fetchone()
-                return dict(row) if row else None
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+                if row is None:
+                    archived = self._select_archived_conversation(cursor, id)
+                    if archived is None:
+                        return None
+                    archived["conversation"] = [{"role": message["role"], "content": message["content"]}
+                                                for message in archived.pop("messages")]
+                    return archived
+        conversation = dict(row)
+        conversation["conversation"] = self.get_recent_messages(id)
+        return conversation
 
     def get_api_data(self):
         """
         Retrieve all API data records.
         """
-        self.conn.autocommit = True
-        try:
-            with self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
                 cursor.execute("SELECT * FROM public.api_data")
                 rows = cursor.fetchall()
                 return [dict(row) for row in rows]
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+
+    def get_api_data_page(self, columns=None, limit=100, after=None):
+        """
+        Retrieve one keyset page of API data records; see farmer_db._page.
+        """
+        return self._page("api_data", columns, limit, after)
+
+    def iter_api_data(self, columns=None, batch_size=DB_STREAM_BATCH_SIZE):
+        """
+        Stream every API data record without loading the table into memory.
+        """
+        return self._stream("api_data", columns, batch_size)
 
     def insert_api_data(self, id, api_data):
         """
         Insert a new API data record with the provided values.
         """
-        try:
-            with self.conn.cursor() as cursor:
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
                 cursor.execute('''
                     INSERT INTO public.api_data (id, 
                         api_data
@@ -275,54 +847,335 @@ class farmer_db:
                     RETURNING id;
                 ''', (id, psycopg2.extras.Json(api_data)))
                 new_id = cursor.fetchone()[0]
-            self.conn.commit()
+                self._refresh_insight_scores(cursor, [new_id])
+                self._notify(cursor, "api_data", [new_id])
             return new_id
-        except Exception as e:
-            self.conn.rollback()
-            raise e
 
     def get_api_data_by_id(self, id):
         """
         Retrieve a single API data record by its ID.
+        Cached: the returned dict is shared between callers and must not be modified.
         """
-        try:
-            with self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        return self._read_through("api_data", id, self._select_api_data_by_id)
+
+    def _select_api_data_by_id(self, id):
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
                 cursor.execute("SELECT * FROM public.api_data WHERE id = %s", (id,))
                 row = cursor.fetchone()
                 return dict(row) if row else None
-        except Exception as e:
-            self.conn.rollback()
-            raise e
 
     def update_api_data(self, id, api_data):
         """
         Update an existing API data record identified by its ID.
         """
-        try:
-            with self.conn.cursor() as cursor:
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
                 cursor.execute('''
                     UPDATE public.api_data
                     SET api_data = %s
                     WHERE id = %s
                 ''', (psycopg2.extras.Json(api_data), id))
-            self.conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+                updated = cursor.rowcount > 0
+                self._refresh_insight_scores(cursor, [id])
+                self._notify(cursor, "api_data", [id])
+            return updated
+
+    def get_api_data_fingerprints(self, ids):
+        """
+        Retrieve only the stored insight fingerprints for the given API data records.
+        """
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT id, api_data->'_fingerprints' FROM public.api_data WHERE id = ANY(%s::uuid[])",
+                    ([str(id) for id in ids],)
+                )
+                rows = cursor.fetchall()
+            return {str(row[0]): row[1] or {} for row in rows}
+
+    def merge_api_data(self, id, api_data):
+        """
+        Merge the given keys into an API data record, inserting the record if it is missing.
+        Keys that are not in api_data keep their stored values; keys set to None are removed.
+        """
+        return self.merge_api_data_many([(id, api_data)]) > 0
+
+    def merge_api_data_many(self, records):
+        """
+        Merge many (id, api_data) pairs in a single statement; see merge_api_data.
+        The insight_scores rows of the merged insights are rewritten in the same transaction.
+        """
+        if not records:
+            return 0
+        removals = [(id, [key for key, value in api_data.items() if value is None]) for id, api_data in records]
+        removals = [(id, keys) for id, keys in removals if keys]
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                if removals:
+                    psycopg2.extras.execute_values(cursor, '''
+                        UPDATE public.api_data AS a
+                        SET api_data = a.api_data - v.removed
+                        FROM (VALUES %s) AS v (id, removed)
+                        WHERE a.id = v.id::uuid
+                    ''', removals, page_size=500)
+                psycopg2.extras.execute_values(cursor, '''
+                    INSERT INTO public.api_data (id, api_data)
+                    VALUES %s
+                    ON CONFLICT (id) DO UPDATE
+                    SET api_data = COALESCE(public.api_data.api_data, '{}'::jsonb) || EXCLUDED.api_data
+                ''', [(id, psycopg2.extras.Json({key: value for key, value in api_data.items() if value is not None}))
+                      for id, api_data in records], page_size=500)
+                ids = [id for id, _ in records]
+                self._refresh_insight_scores(cursor, ids, sorted({key for _, api_data in records for key in api_data}))
+                self._notify(cursor, "api_data", ids)
+            return len(records)
+
+    def upsert_api_data_many(self, records):
+        """
+        Insert or replace many (id, api_data) pairs in one statement. Unlike
+        merge_api_data_many, stored keys missing from api_data are dropped.
+        """
+        if not records:
+            return 0
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                psycopg2.extras.execute_values(cursor, '''
+                    INSERT INTO public.api_data (id, api_data)
+                    VALUES %s
+                    ON CONFLICT (id) DO UPDATE SET api_data = EXCLUDED.api_data
+                ''', [(id, psycopg2.extras.Json(api_data)) for id, api_data in records], page_size=500)
+                ids = [id for id, _ in records]
+                self._refresh_insight_scores(cursor, ids)
+                self._notify(cursor, "api_data", ids)
+            return len(records)
+
+    def _refresh_insight_scores(self, cursor, ids, insights=None):
+        """
+        Rewrite the insight_scores rows of the given api_data records from their
+        stored JSON, inside the caller's transaction. insights limits the rewrite
+        to those keys, e.g. the ones a merge touched.
+        """
+        if ids:
+            cursor.execute(INSIGHT_SCORES_REFRESH, {"ids": [str(id) for id in ids], "insights": insights})
+
+    def find_farms_by_insight(self, insight, min_score=None, max_score=None, interpretation=None, limit=1000):
+        """
+        Farms whose insight score lies in [min_score, max_score] and/or whose
+        interpretation matches, e.g. find_farms_by_insight("Frost Risk", interpretation="High frost risk").
+        Returns {"farm_id", "score", "interpretation", "updatedAt"} dicts, highest score first.
+        """
+        conditions = ["insight = %s"]
+        params = [insight]
+        if min_score is not None:
+            conditions.append("score >= %s")
+            params.append(min_score)
+        if max_score is not None:
+            conditions.append("score <= %s")
+            params.append(max_score)
+        if interpretation is not None:
+            conditions.append("interpretation = %s")
+            params.append(interpretation)
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                cursor.execute(f'''
+                    SELECT farm_id, score, interpretation, "updatedAt"
+                    FROM public.insight_scores
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY score DESC NULLS LAST
+                    LIMIT %s
+                ''', params + [limit])
+                return [dict(row) for row in cursor.fetchall()]
+
+    def top_farms_by_insight(self, insight, k=10, lowest=False):
+        """
+        The k farms with the highest (or, with lowest=True, the lowest) score for an insight.
+        """
+        order = "ASC" if lowest else "DESC"
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                cursor.execute(f'''
+                    SELECT farm_id, score, interpretation, "updatedAt"
+                    FROM public.insight_scores
+                    WHERE insight = %s AND score IS NOT NULL
+                    ORDER BY score {order}
+                    LIMIT %s
+                ''', (insight, k))
+                return [dict(row) for row in cursor.fetchall()]
 
     def delete_api_data_by_id(self, id):
         """
         Delete an API data record by its ID.
         """
-        try:
-            with self.conn.cursor() as cursor:
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
                 cursor.execute("DELETE FROM public.api_data WHERE id = %s", (id,))
-            self.conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            self.conn.rollback()
-            raise e
+                deleted = cursor.rowcount > 0
+                cursor.execute("DELETE FROM public.insight_scores WHERE farm_id = %s", (id,))
+                self._notify(cursor, "api_data", [id])
+            return deleted
+
+    def copy_export(self, table, file, format="csv"):
+        """
+        Write every row of users or api_data to a binary file object with COPY,
+        as CSV with a header row or in Postgres binary format.
+        """
+        if table not in COPY_UPSERT_COLUMNS or format not in COPY_FORMATS:
+            raise ValueError(f"Cannot export {table!r} as {format!r}")
+        options = "FORMAT csv, HEADER true" if format == "csv" else "FORMAT binary"
+        query = psycopg2.sql.SQL("COPY (SELECT {columns} FROM {table} ORDER BY \"createdAt\", id) TO STDOUT WITH ({options})").format(
+            columns=self._columns(table, None), table=psycopg2.sql.Identifier("public", table),
+            options=psycopg2.sql.SQL(options))
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.copy_expert(query, file)
+                return cursor.rowcount
+
+    def copy_import(self, table, file, format="csv"):
+        """
+        Bulk-load users or api_data from a file written by copy_export. Rows are
+        COPYed into a temporary table and upserted by id in a single statement.
+        Returns the number of rows imported.
+        """
+        if table not in COPY_UPSERT_COLUMNS or format not in COPY_FORMATS:
+            raise ValueError(f"Cannot import {table!r} as {format!r}")
+        options = "FORMAT csv, HEADER true" if format == "csv" else "FORMAT binary"
+        target = psycopg2.sql.Identifier("public", table)
+        staging = psycopg2.sql.Identifier(f"{table}_import")
+        columns = self._columns(table, None)
+        updates = psycopg2.sql.SQL(", ").join(
+            psycopg2.sql.SQL("{column} = EXCLUDED.{column}").format(column=psycopg2.sql.Identifier(column))
+            for column in COPY_UPSERT_COLUMNS[table])
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(psycopg2.sql.SQL(
+                    "CREATE TEMP TABLE {staging} (LIKE {target}) ON COMMIT DROP"
+                ).format(staging=staging, target=target))
+                cursor.copy_expert(psycopg2.sql.SQL("COPY {staging} ({columns}) FROM STDIN WITH ({options})").format(
+                    staging=staging, columns=columns, options=psycopg2.sql.SQL(options)), file)
+                cursor.execute(psycopg2.sql.SQL('''
+                    UPDATE {staging} SET "createdAt" = CURRENT_TIMESTAMP WHERE "createdAt" IS NULL;
+                    INSERT INTO {target} ({columns})
+                    SELECT {columns} FROM {staging}
+                    ON CONFLICT (id) DO UPDATE SET {updates}
+                    RETURNING id
+                ''').format(staging=staging, target=target, columns=columns, updates=updates))
+                ids = [row[0] for row in cursor.fetchall()]
+                if table == "api_data":
+                    self._refresh_insight_scores(cursor, ids)
+                self._notify_all(cursor, table)
+            return len(ids)
+
+    def ensure_history_partition(self, day):
+        """
+        Create the monthly daily_history partition that holds the given date.
+        """
+        month = day.replace(day=1)
+        if month in self._history_partitions:
+            return
+        next_month = (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS public.daily_history_{month:%Y_%m}
+                    PARTITION OF public.daily_history
+                    FOR VALUES FROM (%s) TO (%s)
+                ''', (month, next_month))
+            self._history_partitions.add(month)
+
+    def append_daily_history(self, tile, layout, labels, insights, rows):
+        """
+        Append one forecast issue for a tile. rows is a list of
+        (day, means, mins, maxs, sums, scores) tuples aligned with labels/insights.
+        """
+        for day in {row[0] for row in rows}:
+            self.ensure_history_partition(day)
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    INSERT INTO public.history_layouts (layout, labels, insights)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (layout) DO NOTHING
+                ''', (layout, labels, insights))
+                psycopg2.extras.execute_values(cursor, '''
+                    INSERT INTO public.daily_history (tile, day, layout, means, mins, maxs, sums, scores)
+                    VALUES %s
+                ''', [(tile, day, layout, means, mins, maxs, sums, scores)
+                      for day, means, mins, maxs, sums, scores in rows])
+
+    def get_daily_history(self, tile, start_day, end_day):
+        """
+        Retrieve the latest issued row per day for a tile between two dates (inclusive),
+        together with the labels and insights of its layout.
+        """
+        with self.transaction() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute('''
+                    SELECT DISTINCT ON (h.day)
+                        h.day, h.means, h.mins, h.maxs, h.sums, h.scores, l.labels, l.insights
+                    FROM public.daily_history h
+                    JOIN public.history_layouts l ON l.layout = h.layout
+                    WHERE h.tile = %s AND h.day BETWEEN %s AND %s
+                    ORDER BY h.day, h."issuedAt" DESC
+                ''', (tile, start_day, end_day))
+                rows = cursor.fetchall()
+            return [dict(row) for row in rows]
+
+    def insert_forecast_archive(self, tile, results):
+        """
+        Archive the raw endpoint results fetched for a tile.
+        """
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    INSERT INTO public.forecast_archive (tile, results)
+                    VALUES (%s, %s)
+                ''', (tile, psycopg2.extras.Json(results)))
+
+    def get_latest_forecast_archive(self, tiles):
+        """
+        Retrieve {tile: results} with the most recently archived results of each tile.
+        """
+        with self.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    SELECT DISTINCT ON (tile) tile, results
+                    FROM public.forecast_archive
+                    WHERE tile = ANY(%s)
+                    ORDER BY tile, "fetchedAt" DESC
+                ''', (list(tiles),))
+                rows = cursor.fetchall()
+            return {row[0]: row[1] for row in rows}
+
+class async_farmer_db:
+    """
+    Awaitable twin of farmer_db for async handlers: the same method names, each run
+    on a dedicated thread pool sized to the connection pool, so a slow query only
+    holds a worker thread and never the event loop.
+
+        user = await my_async_farmer_db.get_user_by_id(person_id)
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=db.maxconn, thread_name_prefix="farmer_db")
+
+    def __getattr__(self, name):
+        # transaction() hands out a connection for a block of code, which cannot span awaits.
+        if name.startswith("_") or name == "transaction":
+            raise AttributeError(name)
+        method = getattr(self.db, name)
+        if not callable(method):
+            raise AttributeError(name)
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+
+        setattr(self, name, call)
+        return call
+
 
 db_params = {
     "dbname": os.getenv("POSTGRES_DB"),
@@ -335,5 +1188,6 @@ db_params = {
 print(db_params)
 
 my_farmer_db = farmer_db(db_params)
+my_async_farmer_db = async_farmer_db(my_farmer_db)
 
 
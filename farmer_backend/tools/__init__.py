@@ -1,8 +1,11 @@
-from .asyncio_tools import async_to_sync
+from .asyncio_tools import async_to_sync, close_on_loop
 from .extension_id import get_ext_and_mime
 from .tasks import getWhatonImage_celery
 from .gemini import gemini_upload_and_chat
-from .openai_tools import get_openai_embeddings, call_openai_api
+from .openai_tools import get_openai_embeddings, call_openai_api, stream_openai_api, openai_clients
 from .config import QDRANT_CLIENT_HOST, json_schema, json_summary_plan_schema, summary_prompt, GEMINI_PROMPT, OPENAI_API, predefined_questions, build_conversation, build_chat_conversation, update_chat_conversation 
 from .text import split_sentences, generate_embeddings, cosine_distance, average_embeddings, merge_fragments, escape_markdown_v2
 from .mylogger import logger
+from .ttl_cache import TTLCache
+from .compression import compress_json, decompress_json
+from .semantic_cache import SemanticCache
\ No newline at end of file
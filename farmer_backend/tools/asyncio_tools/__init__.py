@@ -1 +1 @@
-from .async_set import async_to_sync
\ No newline at end of file
+from .async_set import async_to_sync, close_on_loop
\ No newline at end of file
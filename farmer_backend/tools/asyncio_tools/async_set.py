@@ -1,3 +1,4 @@
+import asyncio
 
 def async_to_sync(function, *args, **kwargs):
     from asyncio import get_event_loop, new_event_loop, set_event_loop
@@ -8,4 +9,20 @@ def async_to_sync(function, *args, **kwargs):
             loop = new_event_loop()
             set_event_loop(loop)
             return loop.run_until_complete(function(*args, **kwargs))
-        raise e
\ No newline at end of file
+        raise e
+
+
+def close_on_loop(loop, close):
+    """
+    Schedule close() on loop, the event loop that owns a client being replaced:
+    its connections can only be shut down from there. Nothing is left to close
+    once that loop has been closed.
+    """
+    if loop is None or loop.is_closed():
+        return
+    coroutine = close()
+    try:
+        asyncio.run_coroutine_threadsafe(coroutine, loop)
+    except RuntimeError:
+        # Closed in the meantime.
+        coroutine.close()
@@ -0,0 +1,77 @@
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; token counts are estimated from length without it.
+    tiktoken = None
+
+# Tokens the chat format adds around every message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def count_tokens(text):
+    global _encoding
+    if not text:
+        return 0
+    if tiktoken is None:
+        # Roughly four characters per token for English text.
+        return len(text) // 4 + 1
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message):
+    return count_tokens(message.get("content")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def messages_tokens(messages):
+    return sum(message_tokens(message) for message in messages)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text to at most max_tokens tokens, marking the cut."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if tiktoken is None:
+        return text[:max_tokens * 4] + " [...]"
+    return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens]) + " [...]"
+
+
+def build_prompt(head, history, tail, budget):
+    """
+    Fit a chat prompt into budget tokens.
+
+    head (system prompt, conversation summary) and tail (this turn's messages)
+    are always included. The history messages between them, oldest first, are
+    kept newest first for as long as they fit. Returns (prompt, kept), kept
+    being the number of history messages included.
+    """
+    remaining = budget - messages_tokens(head) - messages_tokens(tail)
+    kept = 0
+    for message in reversed(history):
+        remaining -= message_tokens(message)
+        if remaining < 0:
+            break
+        kept += 1
+    return head + history[len(history) - kept:] + tail, kept
+
+
+def messages_to_fold(history, budget, max_fold_tokens):
+    """
+    Oldest history messages to fold into the conversation summary once the
+    history is over budget tokens: enough to bring it down to half the budget,
+    so compaction runs every few turns rather than every turn, and at most
+    max_fold_tokens worth per pass.
+    """
+    total = messages_tokens(history)
+    if total <= budget:
+        return []
+    fold = []
+    folded = 0
+    for message in history:
+        if total - folded <= budget // 2 or (fold and folded + message_tokens(message) > max_fold_tokens):
+            break
+        fold.append(message)
+        folded += message_tokens(message)
+    return fold
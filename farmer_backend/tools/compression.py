@@ -0,0 +1,41 @@
+import json
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; archives fall back to zlib without it.
+    zstandard = None
+
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 9
+
+
+def default_codec():
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def compress_json(value, codec=None):
+    """
+    Serialise value as compact JSON and compress it. Returns (codec, payload);
+    store the codec next to the payload so decompress_json can read it back.
+    """
+    codec = codec or default_codec()
+    raw = json.dumps(value, separators=(",", ":"), default=str).encode()
+    if codec == "zstd":
+        return codec, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    if codec == "zlib":
+        return codec, zlib.compress(raw, ZLIB_LEVEL)
+    raise ValueError(f"Unknown compression codec: {codec!r}")
+
+
+def decompress_json(codec, payload):
+    payload = bytes(payload)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed archives")
+        raw = zstandard.ZstdDecompressor().decompress(payload)
+    elif codec == "zlib":
+        raw = zlib.decompress(payload)
+    else:
+        raise ValueError(f"Unknown compression codec: {codec!r}")
+    return json.loads(raw)
@@ -1,6 +1,8 @@
+import asyncio
 import base64
+import os
 import aiohttp
-import openai
+import httpx
 from .config import OPENAI_API
 import numpy as np
 from PIL import Image
@@ -12,13 +14,71 @@ import json
 # from pydantic import BaseModel
 # from celery import shared_task
 from .mylogger import logger
+from .asyncio_tools import close_on_loop
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 100))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT_SECONDS", 60))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", 5))
+# Retried with exponential backoff by the SDK: connection errors, 408, 409, 429 and 5xx.
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 3))
+
+
+class OpenAIClients:
+    """
+    Long-lived AsyncOpenAI clients shared by chat, structured-output and embedding calls.
+
+    Every client sits on one pooled httpx.AsyncClient, so concurrent requests reuse
+    keep-alive connections instead of opening a new one per call, and are bounded
+    by connect and read timeouts. There is one client per base_url, recreated when
+    the running event loop changes (the Celery tasks run their own loops); the
+    replaced clients are closed on their own loop.
+    """
+
+    def __init__(self, max_connections=OPENAI_MAX_CONNECTIONS, timeout=OPENAI_TIMEOUT,
+                 connect_timeout=OPENAI_CONNECT_TIMEOUT, max_retries=OPENAI_MAX_RETRIES):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self._clients = {}
+        self._loop = None
+
+    def get(self, base_url=None):
+        # httpx connections belong to the loop that opened them.
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            for client in self._clients.values():
+                close_on_loop(self._loop, client.close)
+            self._clients = {}
+            self._loop = loop
+        client = self._clients.get(base_url)
+        if client is None:
+            http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+            client = self._clients[base_url] = AsyncOpenAI(
+                api_key=OPENAI_API, base_url=base_url, max_retries=self.max_retries,
+                http_client=http_client,
+            )
+        return client
+
+    async def aclose(self):
+        clients, self._clients = list(self._clients.values()), {}
+        self._loop = None
+        for client in clients:
+            await client.close()
+
+
+openai_clients = OpenAIClients()
+
 
 async def call_openai_api(conversation: list[dict], json_schema: str = None, model: str = "gpt-4o-mini") -> str:
     """
     Asynchronously call the OpenAI API and return the parsed response content as a string.
     """
-    client = openai.Client()
-    client.api_key = OPENAI_API  # Ensure OPENAI_API is defined correctly
+    client = openai_clients.get()
 
     params = {
         "model": model,
@@ -30,7 +90,7 @@ async def call_openai_api(conversation: list[dict], json_schema: str = None, mod
         params["response_format"] = json_schema
 
     try:
-        response = client.beta.chat.completions.parse(**params)
+        response = await client.beta.chat.completions.parse(**params)
         logger.info("Full response: %s", response)
         
         content = response.choices[0].message.content.strip()
@@ -45,6 +105,28 @@ async def call_openai_api(conversation: list[dict], json_schema: str = None, mod
         raise e
 
 
+async def stream_openai_api(conversation: list[dict], model: str = "gpt-4o-mini"):
+    """
+    Asynchronously call the OpenAI API in streaming mode, yielding the response
+    content piece by piece as the tokens arrive.
+    """
+    client = openai_clients.get()
+    try:
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=conversation,
+            temperature=0.7,
+            max_tokens=15000,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        logger.error(f"OpenAI API streaming error: {e}")
+        raise e
+
+
 def load_image(image_bytes):
     # Ensure the image file is opened correctly
     print("Type of image_bytes:", type(image_bytes))
@@ -107,11 +189,7 @@ async def get_openai_embeddings(
     model: str = "text-embedding-3-small",
     base_url: str = None,
 ) -> np.ndarray:
-    openai.api_key = OPENAI_API
-    openai_async_client = (
-        AsyncOpenAI() if base_url is None else AsyncOpenAI(base_url=base_url)
-    )
-    response = await openai_async_client.embeddings.create(
+    response = await openai_clients.get(base_url).embeddings.create(
         model=model, input=texts, encoding_format="float"
     )
   
@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Thread-safe cache of answers looked up by question embedding instead of exact key.
+
+    Entries are scoped to a tenant (one farmer) and to a snapshot hash of the data
+    the answer was generated from. A lookup returns the answer of the most similar
+    cached question of the same tenant and snapshot when its cosine similarity
+    clears the threshold. Entries expire after a time-to-live, and the least
+    recently used ones are evicted once the cache, or one tenant's share of it,
+    is full. Hit, miss and eviction counters are kept like TTLCache's.
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600, threshold=0.95, max_per_tenant=100):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_per_tenant = max_per_tenant
+        self._data = OrderedDict()  # (tenant, n) -> (expires_at, snapshot, vector, answer), LRU order
+        self._tenants = {}  # tenant -> OrderedDict of its keys, LRU order
+        self._next = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, key):
+        # Callers hold self._lock.
+        del self._data[key]
+        keys = self._tenants[key[0]]
+        del keys[key]
+        if not keys:
+            del self._tenants[key[0]]
+
+    def get(self, tenant, embedding, snapshot):
+        """Cached answer for a question similar enough to embedding, or None."""
+        vector = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for key in list(self._tenants.get(tenant, ())):
+                expires_at, entry_snapshot, entry_vector, _ = self._data[key]
+                if expires_at < now:
+                    self._remove(key)
+                elif entry_snapshot == snapshot:
+                    candidates.append((key, entry_vector))
+            if candidates:
+                similarities = np.stack([entry_vector for _, entry_vector in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    key = candidates[best][0]
+                    self._data.move_to_end(key)
+                    self._tenants[tenant].move_to_end(key)
+                    self.hits += 1
+                    return self._data[key][3]
+            self.misses += 1
+            return None
+
+    def set(self, tenant, embedding, snapshot, answer, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            key = (tenant, self._next)
+            self._next += 1
+            self._data[key] = (time.monotonic() + ttl, snapshot, self._normalize(embedding), answer)
+            self._tenants.setdefault(tenant, OrderedDict())[key] = None
+            while len(self._tenants[tenant]) > self.max_per_tenant:
+                self._remove(next(iter(self._tenants[tenant])))
+                self.evictions += 1
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self, tenant=None):
+        with self._lock:
+            if tenant is None:
+                self._data.clear()
+                self._tenants.clear()
+                return
+            for key in list(self._tenants.get(tenant, ())):
+                self._remove(key)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "tenants": len(self._tenants),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -1,7 +1,7 @@
 import numpy as np
 # from google import genai
 # from rag_app.config import get_google_api_key
-from .openai_tools import get_openai_embeddings
+from .openai_tools import get_openai_embeddings, openai_clients
 import asyncio
 from celery import shared_task, group
 import re
@@ -86,6 +86,8 @@ def generate_embeddings(sentences: list[str]) -> list[list[float]]:
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     embeddings = loop.run_until_complete(get_openai_embeddings(sentences))
+    # The shared clients' connections belong to this loop; close them with it.
+    loop.run_until_complete(openai_clients.aclose())
     loop.close()
 
     return [embedding.flatten().tolist() for embedding in embeddings]  # ✅ Returns all embeddings